@@ -0,0 +1,158 @@
+"""
+Анализ поля средствами NumPy: фишки, через которые вода не может пройти ни при каком повороте,
+и фишки, поворот которых уже не может быть другим
+
+numpy - необязательная зависимость: без неё анализ недоступен (available() возвращает False)
+"""
+from board import RIGHT, UP, LEFT, DOWN, DX, DY, PIPES, START, END, CONNECTIONS, OPENINGS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def build_pairs_table():
+    """
+    Построение таблицы пар сторон, которые соединяет труба
+
+    Индекс таблицы: тип трубы * 4 + поворот. Значение: битовые маски пар сторон. У начальной и конечной
+    фишек одна открытая сторона, поэтому их "пара" состоит из одной стороны
+    """
+    table = []
+    for pipe in range(len(PIPES)):
+        for rotation in range(4):
+            if pipe in (START, END):
+                table.append((OPENINGS[pipe * 4 + rotation],))
+            else:
+                table.append(tuple(1 << (side_a + rotation) % 4 | 1 << (side_b + rotation) % 4
+                                   for side_a, side_b, _ in CONNECTIONS[pipe]))
+    return tuple(table)
+
+
+PAIRS = build_pairs_table()
+
+
+def build_sides_tables():
+    """
+    Построение таблиц, зависящих от поворота фишки и маски сторон, через которые вода может пройти дальше
+
+    Индекс таблиц: (тип трубы * 4 + поворот) * 16 + маска сторон. Значения:
+    стороны, которые фишка может использовать хотя бы при одном повороте; маска поворотов, при которых
+    вода может пройти через фишку; признак того, что все такие повороты равнозначны текущему
+    """
+    edges, rotations, fixed = [], [], []
+    for code in range(len(PIPES) * 4):
+        pipe = code // 4
+        for sides in range(16):
+            usable = [rotation for rotation in range(4)
+                      if any(pair & sides == pair for pair in PAIRS[pipe * 4 + rotation])]
+            edges.append(sum(1 << side for side in range(4)
+                             if any(pair & sides == pair and pair >> side & 1
+                                    for rotation in usable for pair in PAIRS[pipe * 4 + rotation])))
+            rotations.append(sum(1 << rotation for rotation in usable))
+            fixed.append(code % 4 in usable and all(set(PAIRS[pipe * 4 + rotation]) == set(PAIRS[code])
+                                                    for rotation in usable))
+    return tuple(edges), tuple(rotations), tuple(fixed)
+
+
+EDGES, ROTATIONS, FIXED = build_sides_tables()
+
+
+def available():
+    """
+    Доступность анализа (установлен ли numpy)
+    """
+    return np is not None
+
+
+def analyse(board, reachability=False):
+    """
+    Анализ поля
+
+    Сторона фишки считается проходимой, если за ней есть соседняя фишка, которая может пропустить воду
+    через общую сторону. Сначала все стороны внутри поля считаются проходимыми, затем фишки, потерявшие
+    возможность пропустить воду через сторону, закрывают соответствующие стороны соседей, пока изменения
+    не прекратятся. Первый проход выполняется над всем полем, следующие - только над изменившимися фишками,
+    поэтому поле 1000x1000 анализируется за десятки миллисекунд. Условие необходимое, но не достаточное:
+    пути воды через живые фишки могут быть несовместимы друг с другом.
+    reachability - дополнительная проверка связности: фишки, до которых вода не может дойти от начальной
+    фишки, тоже считаются мёртвыми. Она добавляет 15 мс на поле 256x256 (наибольшем в игре), но 0,15 с
+    на поле 1000x1000, поэтому выполняется только по запросу.
+    Возвращает массивы размера (строки, столбцы): мёртвые фишки (вода не проходит ни при каком повороте),
+    зафиксированные фишки (текущий поворот - единственный полезный) и маски полезных поворотов
+    """
+    cells = np.frombuffer(bytes(board.cells), dtype=np.uint8).reshape(board.rows, board.cols)
+    pipes = (cells >> 2).astype(np.intp) * 64  # Индекс таблиц без поворота
+    edges_table = np.array(EDGES, np.uint8)
+    rotations_table = np.array(ROTATIONS, np.uint8)
+    fixed_table = np.array(FIXED, bool)
+
+    # Стороны, за которыми есть соседняя фишка
+    sides = np.zeros(cells.shape, np.uint8)
+    sides[:, :-1] |= 1 << RIGHT
+    sides[1:, :] |= 1 << UP
+    sides[:, 1:] |= 1 << LEFT
+    sides[:-1, :] |= 1 << DOWN
+
+    edges = edges_table[pipes + sides]  # Стороны, через которые фишка может пропустить воду
+    lost = sides & ~edges  # Стороны, которые соседи считают проходимыми, но фишка использовать не может
+    ys, xs = np.nonzero(lost)
+    lost = lost[ys, xs]
+    while len(ys):
+        # Закрытие сторон соседей, смежных с потерянными сторонами
+        neighbours = []
+        for direction in range(4):
+            selected = (lost >> direction & 1).astype(bool)
+            neighbour_ys, neighbour_xs = ys[selected] + DY[direction], xs[selected] + DX[direction]
+            np.bitwise_and.at(sides, (neighbour_ys, neighbour_xs), ~(1 << (direction + 2) % 4) & 15)
+            neighbours.append(neighbour_ys * board.cols + neighbour_xs)
+
+        # Пересчёт сторон, через которые соседи могут пропустить воду
+        ys, xs = np.divmod(np.unique(np.concatenate(neighbours)), board.cols)
+        new_edges = edges_table[pipes[ys, xs] + sides[ys, xs]]
+        lost = edges[ys, xs] & ~new_edges
+        edges[ys, xs] = new_edges
+        selected = lost != 0
+        ys, xs, lost = ys[selected], xs[selected], lost[selected]
+
+    index = cells.astype(np.intp) * 16 + sides
+    rotations = rotations_table[index]
+    fixed = fixed_table[index]
+    if reachability:
+        reached = reachable(edges)
+        rotations[~reached] = 0
+        fixed &= reached
+    return rotations == 0, fixed, rotations
+
+
+def reachable(edges):
+    """
+    Фишки, до которых может дойти вода от начальной фишки (0, 0) через стороны, проходимые для обеих соседних фишек
+
+    Компоненты связности ищутся объединением множеств: корень каждой пары соединённых компонент
+    присоединяется к корню с меньшим номером, после чего пути до корней сжимаются. Каждый проход
+    обрабатывает все пары сразу, а пары внутри уже объединённых компонент отбрасываются, поэтому проходов
+    немного. Возвращает массив размера (строки, столбцы)
+    """
+    rows, cols = edges.shape
+    index = np.arange(rows * cols).reshape(rows, cols)
+    right = (edges[:, :-1] >> RIGHT & edges[:, 1:] >> LEFT & 1).astype(bool)  # Соединённые соседи по строке
+    down = (edges[:-1, :] >> DOWN & edges[1:, :] >> UP & 1).astype(bool)  # Соединённые соседи по столбцу
+    tiles_a = np.concatenate((index[:, :-1][right], index[:-1, :][down]))
+    tiles_b = np.concatenate((index[:, 1:][right], index[1:, :][down]))
+
+    parent = np.arange(rows * cols)  # Корни компонент
+    while True:
+        roots_a, roots_b = parent[tiles_a], parent[tiles_b]
+        selected = roots_a != roots_b  # Пары внутри одной компоненты больше не нужны
+        if not selected.any():
+            break
+        tiles_a, tiles_b, roots_a, roots_b = tiles_a[selected], tiles_b[selected], roots_a[selected], roots_b[selected]
+        parent[np.maximum(roots_a, roots_b)] = np.minimum(roots_a, roots_b)
+        while True:  # Сжатие путей: каждая фишка указывает на корень своей компоненты
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    return (parent == parent[0]).reshape(rows, cols)
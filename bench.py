@@ -0,0 +1,196 @@
+"""
+Замеры производительности: запуск и переходы между состояниями, отрисовка, движение воды, создание игры
+и таблица рекордов
+
+Запуск: python bench.py [--repeat N] [--output bench_results.json]
+"""
+import argparse
+import json
+import os
+import time
+from random import Random
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # Замеры не требуют окна
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame  # noqa: E402
+
+import main  # noqa: E402
+from engine import Engine  # noqa: E402
+from generator import generate  # noqa: E402
+from scores import ScoreStore  # noqa: E402
+from solver import solve  # noqa: E402
+
+SIZES = [(9, 9), (12, 18), (18, 24), (18, 36), (200, 200)]  # Размеры поля (строки, столбцы)
+LEADERBOARD_SIZES = [1000, 10000]  # Количество рекордов в таблице
+
+
+def percentiles(samples):
+    """
+    Процентили времени выполнения в миллисекундах
+    """
+    samples = sorted(samples)
+    result = {'count': len(samples), 'mean': sum(samples) / len(samples) * 1000}
+    for p in (50, 90, 99):
+        result[f'p{p}'] = samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000
+    result['max'] = samples[-1] * 1000
+    return result
+
+
+def measure(function, repeat):
+    """
+    Замер времени выполнения функции
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_startup(app, repeat):
+    """
+    Замеры переходов между состояниями (создание состояния и его первый кадр)
+    """
+    app.rows, app.cols = 9, 9
+    results = {}
+    board = generate(9, 9, app.difficulty, seed=0)
+
+    def game(application):
+        return main.Game(application, prepared=(board.copy(), None, 0))
+
+    for name, state in (('leaderboard', main.Leaderboard), ('game', game), ('main_menu', main.MainMenu)):
+        def switch():
+            app.state = state(app)
+            app.state.render()
+
+        results[name] = measure(switch, max(repeat // 10, 5))
+    return results
+
+
+def bench_game(app, rows, cols, repeat, rng):
+    """
+    Замеры игрового процесса для одного размера поля
+    """
+    app.rows, app.cols = rows, cols
+    board = generate(rows, cols, app.difficulty, rng=rng)  # Поля игр замеров генерируются заранее, а не в пуле
+    results = {'init': measure(lambda: main.Game(app, prepared=(board.copy(), None, None)), max(repeat // 10, 5))}
+
+    game = main.Game(app, prepared=(board.copy(), None, None))
+    app.state = game
+    game.render()
+
+    def full_frame():
+        game.redraw = True
+        game.chunks.clear()  # Видимые блоки поля отрисовываются заново
+        game.render()
+
+    def move_frame():
+        x, y = rng.randrange(cols), rng.randrange(rows)
+        game.rotate_tile(x, y, 1)
+        game.apply_moves()
+        game.render()
+
+    results['render_full'] = measure(full_frame, repeat)
+    results['render_move'] = measure(move_frame, repeat)
+
+    engine = Engine(generate(rows, cols, app.difficulty, rng=rng))
+
+    def move():
+        engine.rotate(rng.randrange(cols), rng.randrange(rows), rng.choice((1, -1)))
+        engine.win = False  # Замер продолжается и после случайной победы
+
+    # Случайные фишки почти никогда не лежат на пути воды, поэтому здесь замеряется быстрый выход из check_win
+    results['check_win'] = measure(move, repeat * 10)
+
+    # Пересчёт пути воды на собранном поле, где вода проходит весь путь до конечной фишки
+    board = generate(rows, cols, app.difficulty, rng=rng)
+    for x, y, turns in solve(board):
+        board.rotate(x, y, turns)
+    engine = Engine(board)
+    path = [(x, y) for x, y, _ in engine.water[1:-1]]
+    results['check_win_full'] = measure(engine.check_win, repeat)
+
+    def path_move():
+        x, y = rng.choice(path)
+        engine.win = False
+        engine.rotate(x, y, 1)  # Путь пересчитывается от повёрнутой фишки до места, где остановилась вода
+        engine.win = False
+        engine.rotate(x, y, -1)  # и после обратного поворота - снова до конечной фишки
+
+    results['path_move'] = measure(path_move, repeat * 10)
+    results['generate'] = measure(lambda: generate(rows, cols, app.difficulty, rng=rng), repeat)
+    return results
+
+
+def bench_leaderboard(app, entries, repeat, rng):
+    """
+    Замеры таблицы рекордов с заданным количеством рекордов
+    """
+    app.scores = ScoreStore(':memory:', None)
+    app.scores.update({f'Игрок {i}': {'score': rng.randrange(10 ** 7), 'size': '9x9', 'time': '01:23', 'turns': 42}
+                       for i in range(entries)})
+    results = {'init': measure(lambda: main.Leaderboard(app), max(repeat // 10, 5))}
+
+    leaderboard = main.Leaderboard(app)
+    app.state = leaderboard
+
+    def render():
+        leaderboard.page = rng.randrange(1, leaderboard.last_page + 1)
+        leaderboard.render()
+
+    results['render'] = measure(render, repeat)
+    app.scores.close()
+    return results
+
+
+def run(repeat, seed):
+    """
+    Запуск всех замеров
+    """
+    rng = Random(seed)
+    start = time.perf_counter()
+    # Замеры не трогают рекорды и запись игры игрока: рекорды хранятся в памяти, запись не сохраняется
+    app = main.App(seed, scores=ScoreStore(':memory:', None), record_path=None)
+    app.state.render()
+    first_frame = time.perf_counter() - start  # Время до первого кадра главного меню (без импорта модулей)
+    app.board_pool.close()  # Поля генерируются внутри замеров, а не в фоновых процессах
+    scores = app.scores
+
+    results = {'pygame': pygame.version.ver, 'repeat': repeat, 'seed': seed, 'startup': {}, 'game': {},
+               'leaderboard': {}}
+    results['startup']['app'] = {'first_frame': percentiles([first_frame])}
+    results['startup']['switch'] = bench_startup(app, repeat)
+    for rows, cols in SIZES:
+        results['game'][f'{rows}x{cols}'] = bench_game(app, rows, cols, repeat, rng)
+    for entries in LEADERBOARD_SIZES:
+        results['leaderboard'][str(entries)] = bench_leaderboard(app, entries, repeat, rng)
+
+    app.scores = scores
+    pygame.quit()
+    return results
+
+
+def report(results):
+    """
+    Вывод результатов в консоль
+    """
+    for group in ('startup', 'game', 'leaderboard'):
+        for size, measurements in results[group].items():
+            for name, stats in measurements.items():
+                print(f'{group:<12}{size:<8}{name:<16}'
+                      f'p50 {stats["p50"]:8.3f} ms   p90 {stats["p90"]:8.3f} ms   p99 {stats["p99"]:8.3f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры производительности игры "Трубопровод"')
+    parser.add_argument('--repeat', type=int, default=100, help='количество повторов каждого замера')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора случайных чисел')
+    parser.add_argument('--output', default='bench_results.json', help='файл для результатов в формате JSON')
+    args = parser.parse_args()
+
+    bench_results = run(args.repeat, args.seed)
+    report(bench_results)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(bench_results, f, ensure_ascii=False, indent=2)
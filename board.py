@@ -0,0 +1,203 @@
+"""
+Игровое поле и правила соединения труб на фишках
+"""
+import hashlib
+import struct
+
+RIGHT, UP, LEFT, DOWN = range(4)  # Направления движения воды (против часовой стрелки, как и углы поворота)
+FINISH = 4  # Вода достигла конечной фишки
+DX = (1, 0, -1, 0)  # Смещение по оси X при движении воды в каждом направлении
+DY = (0, -1, 0, 1)  # Смещение по оси Y при движении воды в каждом направлении
+
+PIPES = ('straight', 'bend', 'cross', 'start', 'end')  # Типы труб
+STRAIGHT, BEND, CROSS, START, END = range(len(PIPES))
+PIPE_IDS = {pipe: pipe_id for pipe_id, pipe in enumerate(PIPES)}
+
+# Соединения сторон фишки без поворота: (сторона, сторона, изображение воды).
+# Сторона обозначается направлением от центра фишки к ней
+CONNECTIONS = {
+    STRAIGHT: [(LEFT, RIGHT, STRAIGHT)],
+    BEND: [(LEFT, DOWN, BEND)],
+    CROSS: [(LEFT, DOWN, BEND), (RIGHT, UP, CROSS)],  # Нижнее и верхнее колено
+    START: [],
+    END: []
+}
+
+
+def build_flow_table():
+    """
+    Построение таблицы движения воды
+
+    Индекс таблицы: (тип трубы * 4 + поворот) * 4 + направление движения воды, входящей в фишку.
+    Значение: (направление движения воды, выходящей из фишки, тип изображения воды) или None
+    """
+    table = [None] * (len(PIPES) * 16)
+    for pipe, connections in CONNECTIONS.items():
+        for rotation in range(4):
+            for side_a, side_b, water in connections:
+                side_a, side_b = (side_a + rotation) % 4, (side_b + rotation) % 4
+                # Вода, входящая через сторону, движется в противоположном ей направлении
+                table[(pipe * 4 + rotation) * 4 + (side_a + 2) % 4] = (side_b, water)
+                table[(pipe * 4 + rotation) * 4 + (side_b + 2) % 4] = (side_a, water)
+
+        if pipe == END:  # Конечная фишка без поворота принимает воду, движущуюся вправо
+            for rotation in range(4):
+                table[(pipe * 4 + rotation) * 4 + rotation] = (FINISH, END)
+    return tuple(table)
+
+
+FLOW = build_flow_table()
+
+
+def build_openings_table():
+    """
+    Построение таблицы открытых сторон фишек в виде битовых масок
+
+    Индекс таблицы: тип трубы * 4 + поворот
+    """
+    table = []
+    for pipe in range(len(PIPES)):
+        for rotation in range(4):
+            if pipe == START:
+                table.append(1 << rotation)
+            elif pipe == END:
+                table.append(1 << (rotation + 2) % 4)
+            else:
+                mask = 0
+                for side_a, side_b, _ in CONNECTIONS[pipe]:
+                    mask |= 1 << (side_a + rotation) % 4 | 1 << (side_b + rotation) % 4
+                table.append(mask)
+    return tuple(table)
+
+
+OPENINGS = build_openings_table()
+
+
+def flow(pipe, rotation, direction):
+    """
+    Определение направления, в котором будет двигаться вода, и изображения воды в фишке
+    """
+    return FLOW[(pipe * 4 + rotation) * 4 + direction]
+
+
+TERMINAL = 3  # Тип начальной или конечной фишки в двоичном представлении поля
+BOARD_HEADER = struct.Struct('>HH')  # Заголовок двоичного представления поля: строки, столбцы
+
+
+class Board:
+    """
+    Игровое поле
+
+    Каждая фишка хранится одним байтом: тип трубы * 4 + поворот
+    """
+
+    def __init__(self, rows, cols, cells=None):
+        self.rows, self.cols = rows, cols
+        self.cells = bytearray(rows * cols) if cells is None else bytearray(cells)
+
+    def __eq__(self, other):
+        return (isinstance(other, Board) and (self.rows, self.cols) == (other.rows, other.cols)
+                and self.cells == other.cells)
+
+    def copy(self):
+        """
+        Копирование поля
+        """
+        return Board(self.rows, self.cols, self.cells)
+
+    def key(self):
+        """
+        Неизменяемое представление поля для хэширования
+        """
+        return self.rows, self.cols, bytes(self.cells)
+
+    def to_bytes(self):
+        """
+        Компактное двоичное представление поля: заголовок с количеством строк и столбцов, затем по 4 бита
+        на фишку (тип трубы * 4 + поворот), две фишки в байте
+
+        Начальная и конечная фишки всегда стоят в углах поля, поэтому обе записываются типом TERMINAL
+        """
+        if self.cells[0] >> 2 != START or self.cells[-1] >> 2 != END or max(self.cells[1:-1], default=0) >> 2 > CROSS:
+            raise ValueError('Начальная и конечная фишки должны стоять в углах поля')
+        codes = bytearray(self.cells)
+        codes[0], codes[-1] = TERMINAL << 2 | codes[0] & 3, TERMINAL << 2 | codes[-1] & 3
+        codes.append(0)  # Дополнение до целого байта
+        return BOARD_HEADER.pack(self.rows, self.cols) + bytes(a << 4 | b for a, b in zip(codes[::2], codes[1::2]))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Восстановление поля из двоичного представления
+        """
+        rows, cols = BOARD_HEADER.unpack_from(data)
+        if len(data) != BOARD_HEADER.size + (rows * cols + 1) // 2:
+            raise ValueError('Неверная длина двоичного представления поля')
+        body = data[BOARD_HEADER.size:]
+        cells = bytearray(2 * len(body))
+        cells[0::2] = bytes(byte >> 4 for byte in body)
+        cells[1::2] = bytes(byte & 15 for byte in body)
+        del cells[rows * cols:]  # Дополнение до целого байта
+        if max(cells[1:-1], default=0) >> 2 > CROSS:
+            raise ValueError('Начальная и конечная фишки должны стоять в углах поля')
+        cells[0] = START << 2 | cells[0] & 3
+        cells[-1] = END << 2 | cells[-1] & 3
+        return cls(rows, cols, cells)
+
+    def digest(self):
+        """
+        Хэш поля (одинаков для одинаковых полей, в том числе полученных из одного начального значения)
+        """
+        return hashlib.blake2b(self.to_bytes(), digest_size=8).hexdigest()
+
+    def pipe(self, x, y):
+        """
+        Тип трубы фишки
+        """
+        return self.cells[y * self.cols + x] >> 2
+
+    def rotation(self, x, y):
+        """
+        Поворот фишки (количество поворотов на 90 градусов против часовой стрелки)
+        """
+        return self.cells[y * self.cols + x] & 3
+
+    def set(self, x, y, pipe, rotation):
+        """
+        Установка фишки
+        """
+        self.cells[y * self.cols + x] = pipe << 2 | rotation & 3
+
+    def rotate(self, x, y, turns):
+        """
+        Поворот фишки на turns * 90 градусов против часовой стрелки (по часовой стрелке при turns < 0)
+        """
+        i = y * self.cols + x
+        self.cells[i] = self.cells[i] & ~3 | (self.cells[i] + turns) & 3
+
+    def flow(self, x, y, direction):
+        """
+        Определение направления, в котором будет двигаться вода, и изображения воды в фишке
+        """
+        return FLOW[self.cells[y * self.cols + x] * 4 + direction]
+
+    def trace(self):
+        """
+        Прохождение воды от начальной фишки (0, 0)
+
+        Возвращает список фишек с водой [x, y, изображение воды] и признак достижения конечной фишки
+        """
+        x = y = 0
+        direction = self.rotation(x, y)
+        water = [[x, y, START]]
+        x, y = x + DX[direction], y + DY[direction]
+        while 0 <= x < self.cols and 0 <= y < self.rows:
+            water_flow = FLOW[self.cells[y * self.cols + x] * 4 + direction]
+            if not water_flow:  # Вода остановилась на фишке
+                break
+            direction = water_flow[0]
+            water.append([x, y, water_flow[1]])
+            if direction == FINISH:  # Вода достигла конечной фишки
+                return water, True
+            x, y = x + DX[direction], y + DY[direction]
+        return water, False
@@ -0,0 +1,165 @@
+"""
+Заранее сгенерированные поля: генерация и решение полей в фоновых процессах, чтобы начало игры
+не ждало генератора, а интерфейс не останавливался на генерации и решении больших полей
+"""
+import multiprocessing
+import threading
+from random import Random
+
+from engine import Engine
+from generator import generate
+
+
+def prepare_board(rows, cols, difficulty, seed):
+    """
+    Генерация поля и поиск минимального количества ходов для него (выполняется в фоновом процессе)
+    """
+    board = generate(rows, cols, difficulty, seed=seed)
+    return board, Engine(board).find_optimal_turns(), seed
+
+
+class BoardPool:
+    """
+    Очередь готовых полей выбранного размера, пополняемая фоновыми процессами
+
+    Заранее готовятся не больше workers полей одновременно, поэтому после смены размера поля фоновые процессы
+    заканчивают не больше workers полей старого размера. Поля старого размера остаются в очереди на случай
+    возврата к нему. Ещё один процесс оставлен для поля, которое игрок ждёт прямо сейчас, чтобы оно
+    не ожидало завершения заранее запущенных полей
+    """
+
+    def __init__(self, size=2, workers=2):
+        self.size = size  # Количество готовых полей, которое поддерживается для выбранного размера
+        self.workers = workers
+        self.pool = None  # Процессы запускаются при первой подготовке полей
+        self.starter = None  # Поток, в котором запускаются процессы
+        self.closed = False
+
+        # Выбранные параметры поля: (строки, столбцы, сложность) или (строки, столбцы, сложность, начальное значение)
+        self.target = None
+        self.ready = {}  # Готовые поля: параметры -> [(поле, минимальное количество ходов, начальное значение)]
+        self.running = {}  # Количество генерируемых полей для каждых параметров
+        self.lock = threading.Lock()  # Результаты принимаются в служебном потоке пула процессов
+        self.seeds = Random()  # Начальные значения генератора для каждого поля
+        self.tasks = []  # Задачи вне очереди полей, ожидающие запуска процессов: [(функция, аргументы, обработчик)]
+
+    def prepare(self, rows, cols, difficulty, seed=None):
+        """
+        Выбор размера полей, которые нужно подготовить
+
+        С заданным начальным значением seed готовится только одно поле с этим значением, как и в take
+        """
+        with self.lock:
+            self.target = (rows, cols, difficulty) if seed is None else (rows, cols, difficulty, seed)
+            self.fill()
+
+    def take(self, rows, cols, difficulty, seed=None):
+        """
+        Получение готового поля: (поле, минимальное количество ходов, начальное значение)
+
+        Если готового поля нет, возвращает None, а поле генерируется в фоновом процессе вне очереди
+        (поле с заданным начальным значением seed генерируется один раз и затем выдаётся копиями)
+        """
+        key = (rows, cols, difficulty) if seed is None else (rows, cols, difficulty, seed)
+        with self.lock:
+            boards = self.ready.get(key)
+            if boards and seed is None:
+                prepared = boards.pop(0)
+            elif boards:
+                board, optimal_turns, seed = boards[0]
+                prepared = board.copy(), optimal_turns, seed
+            else:
+                prepared = None
+            self.target = key
+            self.fill(urgent=prepared is None)
+        return prepared
+
+    def fill(self, urgent=False):
+        """
+        Запуск генерации недостающих полей выбранного размера (вызывается под блокировкой)
+
+        urgent - поле нужно сейчас: если оно ещё не генерируется, для него используется запасной процесс
+        """
+        if self.closed or self.target is None:
+            return
+        if self.pool is None:
+            self.start_pool()
+            return
+
+        key = self.target
+        size = self.size if len(key) == 3 else 1  # Поле с заданным начальным значением генерируется один раз
+        workers = self.workers + (urgent and not self.running.get(key))
+        while (sum(self.running.values()) < workers
+               and len(self.ready.get(key, [])) + self.running.get(key, 0) < size):
+            self.running[key] = self.running.get(key, 0) + 1
+            seed = key[3] if len(key) == 4 else self.seeds.getrandbits(32)
+            self.pool.apply_async(prepare_board, key[:3] + (seed,),
+                                  callback=lambda result, key=key: self.done(key, result),
+                                  error_callback=lambda error, key=key: self.done(key, None))
+
+    def submit(self, function, args, callback):
+        """
+        Выполнение функции в фоновом процессе вне очереди полей (например, поиск подсказки)
+
+        callback вызывается в служебном потоке пула с результатом функции или с None при ошибке
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.tasks.append((function, args, callback))
+            self.run_tasks()
+
+    def run_tasks(self):
+        """
+        Передача задач вне очереди полей в процессы (вызывается под блокировкой)
+        """
+        if self.pool is None:
+            self.start_pool()
+            return
+        for function, args, callback in self.tasks:
+            self.pool.apply_async(function, args, callback=callback,
+                                  error_callback=lambda error, callback=callback: callback(None))
+        self.tasks.clear()
+
+    def start_pool(self):
+        """
+        Запуск фоновых процессов в отдельном потоке (вызывается под блокировкой)
+        """
+        if self.starter is None:  # Запуск процессов занимает десятки миллисекунд, поэтому не задерживает кадр
+            self.starter = threading.Thread(target=self.start, daemon=True)
+            self.starter.start()
+
+    def start(self):
+        """
+        Запуск фоновых процессов (выполняется в отдельном потоке)
+        """
+        # Новые процессы не наследуют состояние pygame; запасной процесс - для поля, которое ждёт игрок
+        pool = multiprocessing.get_context('spawn').Pool(self.workers + 1)
+        with self.lock:
+            if not self.closed:
+                self.pool = pool
+                self.fill(urgent=not self.ready.get(self.target))
+                self.run_tasks()
+        if self.pool is not pool:  # Пул остановлен, пока процессы запускались
+            pool.terminate()
+
+    def done(self, key, result):
+        """
+        Приём поля, сгенерированного фоновым процессом
+        """
+        with self.lock:
+            self.running[key] -= 1
+            if result is not None:
+                self.ready.setdefault(key, []).append(result)
+                self.fill()
+
+    def close(self):
+        """
+        Остановка фоновых процессов
+        """
+        with self.lock:
+            self.closed = True
+        if self.starter is not None:  # Процессы, запущенные после остановки, останавливает сам поток запуска
+            self.starter.join()
+        if self.pool is not None:  # Без блокировки: остановка пула ждёт завершения служебного потока
+            self.pool.terminate()
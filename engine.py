@@ -0,0 +1,293 @@
+"""
+Игровые правила без отрисовки: поле, ходы, движение воды и подсчёт очков
+
+Модуль не зависит от pygame, поэтому игры можно моделировать без окна
+"""
+import sys
+from array import array
+from time import monotonic
+
+from board import BOARD_HEADER, DX, DY, FINISH, START, Board
+from solver import solve, count_moves
+
+# Количество фишек, просматриваемых точным решателем (поисков пути × размер поля), после которого решатель
+# ищет любое решение, чтобы подсказка и подсчёт очков на больших полях не занимали минуты
+SOLVE_BUDGET = 100000
+
+
+class Engine:
+    """
+    Игровой процесс без отрисовки
+    """
+
+    def __init__(self, board, optimal_turns=None, clock=monotonic):
+        self.board = board
+        self.initial_board = board.copy()  # Поле в начале игры (для подсчёта минимального количества ходов)
+        self.start_x, self.start_y = 0, 0  # Положение начальной фишки
+        self.end_x, self.end_y = board.cols - 1, board.rows - 1  # Положение конечной фишки
+
+        self.win = False
+        # Время игры считается по монотонным часам, а не по кадрам, поэтому не зависит от скорости отрисовки
+        self.clock = clock  # Источник времени в секундах
+        self.elapsed = 0  # Время игры до начала текущего отрезка без пауз
+        self.started = clock()  # Начало текущего отрезка без пауз (None - время остановлено)
+        self.turns = 0
+        self.final_score = None  # Очки за победу (считаются при первом обращении к score)
+        self.moves = array('I')  # Журнал ходов: индекс фишки * 4 + поворот против часовой стрелки (0-3)
+        self.move_count = 0  # Количество сделанных ходов журнала (следующие ходы отменены и могут быть повторены)
+        self.solve_limit = max(SOLVE_BUDGET // len(board.cells), 1)  # Количество точных поисков пути решателя
+        # Минимальное количество ходов для победы (если не известно заранее, считается при победе;
+        # на больших полях - оценка сверху)
+        self.optimal_turns = optimal_turns
+
+        self.water = []  # Путь воды: координаты и типы труб с водой
+        self.water_in = []  # Направления, в которых вода вошла в фишки пути
+        self.water_index = {}  # Индекс первого появления фишки в пути воды
+        self.water_map = {}  # Типы труб с водой для каждой фишки
+        self.water_stop = None  # Фишка, на которой остановилась вода, и направление движения воды
+        self.changed_tiles = set()  # Фишки, изменившиеся с момента последней отрисовки
+
+        self.check_win()
+
+    @property
+    def time(self):
+        """
+        Время игры в секундах без учёта пауз
+        """
+        if self.started is None:
+            return self.elapsed
+        return self.elapsed + self.clock() - self.started
+
+    @property
+    def score(self):
+        """
+        Очки за победу (до победы - 0)
+
+        Очки считаются при первом обращении, поэтому победа без известного минимального количества ходов
+        (например, при воспроизведении записи) не запускает решатель
+        """
+        if not self.win:
+            return 0
+        if self.final_score is None:
+            self.final_score = self.calculate_score()
+        return self.final_score
+
+    def pause(self):
+        """
+        Остановка счётчика времени
+        """
+        if self.started is not None:
+            self.elapsed = self.time
+            self.started = None
+
+    def resume(self):
+        """
+        Продолжение отсчёта времени после паузы
+        """
+        if self.started is None and not self.win:
+            self.started = self.clock()
+
+    def rotate(self, x, y, turns):
+        """
+        Ход: поворот фишки на 90 градусов против часовой стрелки (turns > 0) или по часовой стрелке (turns < 0)
+        """
+        self.rotate_many([(x, y, turns)])
+
+    def rotate_many(self, moves):
+        """
+        Несколько ходов [(x, y, turns)] подряд
+
+        Ходы выполняются по порядку, но путь воды пересчитывается только после ходов, затрагивающих путь
+        или фишку, на которой остановилась вода (повороты остальных фишек путь не меняют). После победы
+        оставшиеся ходы не выполняются, поэтому победа и количество ходов те же, что и при отдельных ходах
+        """
+        if self.win or not moves:
+            return
+        del self.moves[self.move_count:]  # Новый ход отменяет возможность повторить отменённые ходы
+        for x, y, turns in moves:
+            self.moves.append((y * self.board.cols + x) << 2 | turns & 3)
+            self.board.rotate(x, y, turns)
+            self.changed_tiles.add((x, y))
+            self.turns += 1
+            self.check_win([(x, y)])
+            if self.win:
+                break
+        self.move_count = len(self.moves)
+
+    def undo(self):
+        """
+        Отмена последнего хода
+
+        Возвращает координаты фишки или None, если отменять нечего
+        """
+        if self.win or not self.move_count:
+            return None
+        self.move_count -= 1
+        return self.play(self.moves[self.move_count], -1)
+
+    def redo(self):
+        """
+        Повтор следующего хода журнала (отменённого или записанного)
+
+        Возвращает координаты фишки или None, если повторять нечего
+        """
+        if self.win or self.move_count == len(self.moves):
+            return None
+        self.move_count += 1
+        return self.play(self.moves[self.move_count - 1], 1)
+
+    def play(self, move, direction):
+        """
+        Выполнение хода журнала (direction = 1) или его отмена (direction = -1)
+
+        Отмена и повтор хода считаются ходами игрока, как и поворот фишки: иначе отменой можно было бы уменьшить
+        число ходов в счёте. Путь воды пересчитывается только начиная с повёрнутой фишки
+        """
+        y, x = divmod(move >> 2, self.board.cols)
+        self.board.rotate(x, y, (move & 3) * direction)
+        self.turns += 1
+        self.changed_tiles.add((x, y))
+        self.check_win([(x, y)])
+        return x, y
+
+    def record(self):
+        """
+        Запись игры: двоичное представление начального поля и сделанные ходы журнала
+        """
+        moves = self.moves[:self.move_count]
+        if sys.byteorder == 'big':
+            moves.byteswap()  # Ходы записываются в порядке байтов little-endian
+        return self.initial_board.to_bytes() + moves.tobytes()
+
+    def find_optimal_turns(self):
+        """
+        Поиск минимального количества ходов для победы на начальном поле
+        """
+        return max(count_moves(solve(self.initial_board, self.solve_limit) or []), 1)
+
+    def calculate_score(self):
+        """
+        Подсчёт очков за победу
+        """
+        if self.optimal_turns is None:
+            self.optimal_turns = self.find_optimal_turns()
+        time = max(int(self.time), 1)  # Целые секунды (не меньше одной)
+        turns = self.turns if self.turns > 0 else 1
+        rows, cols = self.board.rows, self.board.cols
+        return (rows ** 2 * cols ** 2 * 100 * self.optimal_turns) // (time * turns)
+
+    def check_win(self, tiles=None):
+        """
+        Проверка победной ситуации
+
+        Если переданы координаты повёрнутых фишек, путь воды пересчитывается только начиная с первой из них
+        на пути воды (участок пути до неё не изменился)
+        """
+        if tiles is None:  # Полный пересчёт пути воды
+            index = 0
+        else:
+            index = None
+            for tile in tiles:
+                if tile in self.water_index:  # Фишка лежит на пути воды
+                    tile_index = self.water_index[tile]
+                elif self.water_stop and tile == self.water_stop[:2]:  # Фишка, на которой остановилась вода
+                    tile_index = len(self.water)
+                else:  # Фишка не влияет на путь воды
+                    continue
+                index = tile_index if index is None else min(index, tile_index)
+            if index is None:
+                return
+
+        # Удаление участка пути, начиная с повёрнутой фишки
+        removed, removed_in = self.water[index:], self.water_in[index:]
+        del self.water[index:], self.water_in[index:]
+        for tile_x, tile_y, _ in reversed(removed):
+            self.water_map[(tile_x, tile_y)].pop()
+            if not self.water_map[(tile_x, tile_y)]:
+                del self.water_map[(tile_x, tile_y)]
+            if self.water_index.get((tile_x, tile_y), -1) >= index:
+                del self.water_index[(tile_x, tile_y)]
+
+        if index == 0:  # Вода начинает движение из начальной фишки
+            x, y = self.start_x, self.start_y
+            self.add_water(x, y, START, None)
+
+            direction = self.board.rotation(x, y)  # Начальная фишка направляет воду в сторону поворота
+            x, y = x + DX[direction], y + DY[direction]
+        elif removed:  # Вода продолжает движение с повёрнутой фишки
+            x, y = removed[0][0], removed[0][1]
+            direction = removed_in[0]
+        else:  # Вода продолжает движение с фишки, на которой остановилась
+            x, y, direction = self.water_stop
+
+        self.water_stop = None
+        while 0 <= x < self.board.cols and 0 <= y < self.board.rows:
+            water_flow = self.board.flow(x, y, direction)  # Определение направления движения воды
+
+            if not water_flow:  # Вода остановилась на фишке
+                self.water_stop = (x, y, direction)
+                break
+
+            self.add_water(x, y, water_flow[1], direction)  # Добавление координат трубы с водой в список
+            direction = water_flow[0]
+
+            if direction == FINISH:  # Вода достигла конечной фишки
+                self.win = True
+                self.pause()  # Время игры останавливается в момент победы
+                break
+
+            x, y = x + DX[direction], y + DY[direction]
+
+        # Пометка фишек, в которых изменилась вода
+        changed = {tuple(pipe) for pipe in removed} ^ {tuple(pipe) for pipe in self.water[index:]}
+        self.changed_tiles.update((tile_x, tile_y) for tile_x, tile_y, _ in changed)
+
+    def add_water(self, x, y, pipe, direction):
+        """
+        Добавление трубы с водой в конец пути воды
+        """
+        self.water.append([x, y, pipe])
+        self.water_in.append(direction)  # Направление, в котором вода вошла в фишку
+        self.water_index.setdefault((x, y), len(self.water) - 1)
+        self.water_map.setdefault((x, y), []).append(pipe)
+
+
+def find_hint(board, limit=None):
+    """
+    Ход, приближающий поле к решению: (x, y, поворот на один шаг) или None
+
+    Функция не зависит от игры, поэтому поиск подсказки на больших полях выполняется в фоновом процессе
+    """
+    moves = solve(board, limit)
+    if moves:
+        x, y, turns = moves[0]
+        return x, y, 1 if turns > 0 else -1
+    return None
+
+
+def load_record(record):
+    """
+    Чтение записи игры: (начальное поле, журнал ходов)
+    """
+    rows, cols = BOARD_HEADER.unpack_from(record)
+    size = BOARD_HEADER.size + (rows * cols + 1) // 2
+    moves = array('I')
+    moves.frombytes(record[size:])
+    if sys.byteorder == 'big':
+        moves.byteswap()
+    return Board.from_bytes(record[:size]), moves
+
+
+def replay(record, optimal_turns=None):
+    """
+    Воспроизведение записи игры без отрисовки
+
+    Возвращает игру после последнего хода записи
+    """
+    board, moves = load_record(record)
+    engine = Engine(board, optimal_turns)
+    engine.pause()  # Время воспроизведения не считается временем игры
+    engine.moves = moves
+    while engine.redo():
+        pass
+    return engine
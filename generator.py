@@ -0,0 +1,103 @@
+"""
+Генерация игрового поля, на котором гарантированно существует путь от начальной фишки до конечной
+"""
+from random import Random
+
+from board import DX, DY, RIGHT, STRAIGHT, BEND, CROSS, START, END, Board, flow
+
+
+def carve_path(rows, cols, length, rng):
+    """
+    Прокладка пути из левой верхней фишки в правую нижнюю
+
+    Путь начинается шагом вправо и заканчивается шагом вправо, чтобы подходить к начальной и конечной фишкам
+    без поворота. Сначала строится случайный кратчайший путь, затем он удлиняется обходами: ребро a-b
+    заменяется на a-c-d-b, где c и d - свободные соседние фишки. Возвращает список координат фишек пути
+    """
+    start, end = (0, 0), (cols - 1, rows - 1)
+
+    # Кратчайший путь со случайным порядком шагов вправо и вниз
+    steps = [(1, 0)] * (cols - 3) + [(0, 1)] * (rows - 1)
+    rng.shuffle(steps)
+    path = [start, (1, 0)]
+    for dx, dy in steps:
+        path.append((path[-1][0] + dx, path[-1][1] + dy))
+    path.append(end)
+
+    # Путь хранится в виде связного списка, чтобы вставка обхода занимала O(1)
+    following = {a: b for a, b in zip(path, path[1:])}
+    cells = path[1:-2]  # Фишки, после которых можно вставить обход
+    used = set(path)
+    size = len(path)
+
+    attempts = 20 * rows * cols
+    while size < length and attempts:
+        attempts -= 1
+        a = cells[rng.randrange(len(cells))]
+        b = following[a]
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        side = rng.choice((1, -1))
+        c, d = (a[0] - dy * side, a[1] + dx * side), (b[0] - dy * side, b[1] + dx * side)
+        if (0 <= c[0] < cols and 0 <= c[1] < rows and 0 <= d[0] < cols and 0 <= d[1] < rows
+                and c not in used and d not in used):
+            following[a], following[c], following[d] = c, d, b
+            used.update((c, d))
+            cells.extend((c, d))
+            size += 2
+
+    path = [start]
+    while path[-1] != end:
+        path.append(following[path[-1]])
+    return path
+
+
+def lay_pipes(rows, cols, path, difficulty, rng):
+    """
+    Расстановка труб вдоль пути и случайных труб на остальных фишках
+
+    Возвращает собранное поле, на котором вода доходит до конечной фишки
+    """
+    board = Board(rows, cols)
+    for i in range(len(board.cells)):
+        board.cells[i] = rng.choice((STRAIGHT, BEND, CROSS)) << 2 | rng.randrange(4)
+
+    board.set(*path[0], START, RIGHT)
+    board.set(*path[-1], END, RIGHT)
+
+    for previous, (x, y), following in zip(path, path[1:-1], path[2:]):
+        direction_in = DX.index(x - previous[0]) if x != previous[0] else DY.index(y - previous[1])
+        direction_out = DX.index(following[0] - x) if following[0] != x else DY.index(following[1] - y)
+
+        if direction_in == direction_out:
+            pipe = STRAIGHT
+        else:  # Поворот воды на колене или на одном из коленей фишки с двумя коленами
+            pipe = CROSS if rng.random() < difficulty / 2 else BEND
+        rotations = [r for r in range(4) if (flow(pipe, r, direction_in) or (None,))[0] == direction_out]
+        board.set(x, y, pipe, rng.choice(rotations))
+    return board
+
+
+def generate(rows, cols, difficulty=0.5, length=None, rng=None, seed=None):
+    """
+    Генерация игрового поля
+
+    difficulty от 0 до 1 определяет длину пути (если не задана length), долю фишек с двумя коленами
+    на пути и долю повёрнутых фишек пути. Одинаковые параметры и начальное значение seed дают одинаковое поле
+    """
+    rng = rng or Random(seed)
+
+    if length is None:
+        shortest = rows + cols - 1
+        length = shortest + int(difficulty * max(rows * cols // 2 - shortest, 0))
+
+    path = carve_path(rows, cols, length, rng)
+    board = lay_pipes(rows, cols, path, difficulty, rng)
+
+    # Поворот фишек пути, чтобы игроку пришлось собрать его заново
+    for x, y in path[1:-1]:
+        if rng.random() < 0.5 + difficulty / 2:
+            board.rotate(x, y, rng.randrange(1, 4))
+
+    while board.trace()[1]:  # Поле не должно быть собрано заранее
+        board.rotate(*rng.choice(path[1:-1]), 1)
+    return board
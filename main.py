@@ -1,7 +1,59 @@
-import pygame
-import pickle
+import argparse
+import glob
 import os
-from random import choice
+import pygame
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+import analysis
+from board import PIPES
+from board_pool import BoardPool
+from engine import Engine, find_hint, load_record
+from profiler import FrameProfiler
+from scores import ScoreStore
+
+images = {}  # Загруженные изображения, общие для всего приложения
+decoded_images = {}  # Изображения, заранее декодированные в фоновом потоке (ещё не преобразованные под экран)
+
+RECORD_PATH = 'data/last_game.rec'  # Запись последней выигранной игры
+
+CHUNK_SIZE = 16  # Размер блока поля в фишках (поле отрисовывается и кэшируется блоками)
+SCALES = (16, 32, 48, 64)  # Допустимые размеры фишки при изменении масштаба
+
+# Подписи этапов кадра в окне замеров
+PROFILER_LABELS = {'frame': 'кадр', 'events': 'события', 'loop': 'цикл', 'wait': 'ожидание FPS',
+                   'render': 'отрисовка', 'check_win': 'проверка победы', 'text': 'текст', 'flip': 'вывод на экран'}
+
+
+def format_time(seconds):
+    """
+    Время игры в виде ММ:СС
+    """
+    seconds = int(seconds)
+    return f'{seconds // 60:02}:{seconds % 60:02}'
+
+
+def load_image(path):
+    """
+    Загрузка изображения (с диска изображение загружается только один раз)
+    """
+    if path not in images:
+        image = decoded_images.pop(path, None) or pygame.image.load(path)
+        images[path] = image.convert_alpha()
+    return images[path]
+
+
+def preload_images(paths):
+    """
+    Декодирование изображений в фоновом потоке
+
+    pygame.image.load отпускает GIL на время декодирования, поэтому первый кадр не ждёт загрузки изображений,
+    а при переходе к другим состояниям остаётся только преобразование под формат экрана
+    """
+    for path in paths:
+        if path not in images:
+            decoded_images[path] = pygame.image.load(path)
 
 
 class App:
@@ -9,74 +61,298 @@ class App:
     Класс приложения
     """
 
-    def __init__(self):
+    def __init__(self, seed=None, record=None, fps=60, preload=True, profile=None, scores=None,
+                 record_path=RECORD_PATH):
         self.running = True
 
-        pygame.init()
+        pygame.display.init()  # Только используемые модули: звук и джойстики игре не нужны
+        pygame.font.init()
+
+        if preload:  # Изображения остальных состояний декодируются, пока отрисовывается главное меню
+            threading.Thread(target=preload_images, args=(sorted(glob.glob('assets/**/*.png', recursive=True)),),
+                             daemon=True).start()
 
-        try:  # Загрузка списка рекордов из файла
-            with open('data/scores.dat', 'rb') as f:
-                self.scores = pickle.load(f)
-        except FileNotFoundError:
-            self.scores = {}
+        # Таблица рекордов (рекорды читаются из файла по запросу)
+        self.scores = ScoreStore() if scores is None else scores
+        self.record_path = record_path  # Файл записи последней выигранной игры (None - запись не сохраняется)
 
         self.player_name = ''
 
         self.screen = pygame.display.set_mode((576, 640))
         pygame.display.set_caption('Игра "Трубопровод"')
-        pygame.display.set_icon(pygame.image.load('assets/icon.png'))
+        pygame.display.set_icon(load_image('assets/icon.png'))
 
         self.rows, self.cols = 9, 9  # Начальное количество строк и столбцов
-        self.min_rows, self.max_rows = 9, 18
-        self.min_cols, self.max_cols = 9, 36
-
-        self.font_32 = pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 32)
-        self.font_45 = pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 45)
-        self.font_64 = pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 64)
-        self.font_32_italic = pygame.font.Font('assets/fonts/OpenSans-Italic.ttf', 32)
+        self.min_rows, self.max_rows = 9, 256
+        self.min_cols, self.max_cols = 9, 256
+        self.difficulty = 0.5  # Сложность генерируемого поля (от 0 до 1)
+        self.seed = seed  # Начальное значение генератора для всех полей (None - новое значение для каждого поля)
 
         self.clock = pygame.time.Clock()
+        self.fps = fps  # Ограничение частоты кадров (0 - без ограничения); на время игры не влияет
+
+        self.sprites = {}  # Кэш повёрнутых и масштабированных изображений труб
+        self.board_pool = BoardPool()  # Поля, заранее сгенерированные в фоновых процессах
+        self.text_cache = TextCache()  # Кэш отрисованного текста
+
+        # Замеры этапов кадра: окно замеров переключается клавишей F3, журнал кадров записывается в файл profile
+        self.profiler = FrameProfiler(profiler_hooks(), trace_path=profile)
+        self.show_profiler = False
+        self.profiler_overlay = None  # Отрисованное окно замеров
+        self.profiler_updated = 0  # Время последнего обновления окна замеров в миллисекундах
+        if profile:
+            self.profiler.enable()
+
+        # Начальное состояние: главное меню или воспроизведение записи игры
+        self.state = MainMenu(self) if record is None else Game(self, record)
+
+    # Шрифты загружаются при первом использовании
+    @cached_property
+    def font_16(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 16)
+
+    @cached_property
+    def font_24(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 24)
+
+    @cached_property
+    def font_32(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 32)
+
+    @cached_property
+    def font_45(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 45)
+
+    @cached_property
+    def font_64(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Regular.ttf', 64)
+
+    @cached_property
+    def font_32_italic(self):
+        return pygame.font.Font('assets/fonts/OpenSans-Italic.ttf', 32)
+
+    def resize(self, width, height):
+        """
+        Изменение размера окна
 
-        self.state = MainMenu(self)  # Начальное состояние
+        set_mode меняет размер существующего окна, поэтому видеосистема не перезапускается,
+        а заголовок и значок окна сохраняются
+        """
+        if self.screen.get_size() != (width, height):
+            self.screen = pygame.display.set_mode((width, height))
 
     def execute(self):
         """
         Запуск приложения
         """
         while self.running:
-            for event in pygame.event.get():
+            if self.profiler.enabled:
+                self.profiler.begin_frame()
+            events = pygame.event.get()
+            if not events and self.state.event_timeout is not None:  # Ожидание событий без нагрузки на процессор
+                events = [pygame.event.wait(self.state.event_timeout)] + pygame.event.get()
+            events = coalesce_wheel(events)
+
+            for event in events:
                 if event.type == pygame.QUIT:  # Игрок закрыл окно
                     self.running = False
-                else:
+                elif event.type == pygame.WINDOWEXPOSED:  # Содержимое окна нужно восстановить
+                    self.state.dirty = True
+                    self.state.event_handler(event)
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:  # Нажатие F3
+                    self.toggle_profiler()
+                elif event.type != pygame.NOEVENT:
                     self.state.event_handler(event)  # Обработка событий текущего состояния
             self.state.loop()  # Цикл текущего состояния
-            self.state.render()  # Отрисовка текущего состояния
-
-        # Сохранение списка рекордов в файл
-        if not os.path.exists('data'):
-            os.mkdir('data')
-        with open('data/scores.dat', 'wb') as f:
-            pickle.dump(self.scores, f)
 
+            if self.state.dirty:  # Отрисовка текущего состояния, только если оно изменилось
+                self.state.dirty = False
+                self.state.render()
+
+            if self.profiler.enabled:
+                # Ожидание ограничения FPS происходит в цикле состояния, но учитывается отдельно
+                wait = (self.clock.get_time() - self.clock.get_rawtime()) / 1000
+                self.profiler.current['loop'] = max(self.profiler.current['loop'] - wait, 0)
+                self.profiler.end_frame(f'{self.rows}x{self.cols}', wait=wait)
+            if self.show_profiler:
+                self.draw_profiler()
+
+        self.scores.close()  # Рекорды уже сохранены в файл при победе
+        self.board_pool.close()
+        self.profiler.disable()
+        self.profiler.save()
         pygame.quit()
 
+    def toggle_profiler(self):
+        """
+        Включение и выключение окна замеров
+        """
+        self.show_profiler = not self.show_profiler
+        if self.show_profiler:
+            self.profiler.enable()
+            self.profiler_overlay = None
+        else:
+            if not self.profiler.trace_path:  # Без журнала кадров замеры больше не нужны
+                self.profiler.disable()
+            pygame.event.post(pygame.event.Event(pygame.WINDOWEXPOSED))  # Восстановление изображения под окном
+
+    def draw_profiler(self):
+        """
+        Отрисовка окна замеров поверх текущего состояния
+
+        Окно показывает средние значения за последние кадры и обновляется два раза в секунду,
+        поэтому само почти не влияет на замеры
+        """
+        now = pygame.time.get_ticks()
+        if self.profiler_overlay is None or now - self.profiler_updated >= 500:
+            self.profiler_updated = now
+            lines = [(f'FPS {self.clock.get_fps():.0f}', f'поле {self.rows}x{self.cols}')]
+            averages = self.profiler.averages()
+            lines += [(label, f'{averages[stage] * 1000:.2f} мс') for stage, label in PROFILER_LABELS.items()
+                      if stage in averages]
+            # Фон непрозрачный, потому что окно каждый кадр рисуется поверх прежнего
+            self.profiler_overlay = pygame.Surface((224, 20 * len(lines) + 8))
+            self.profiler_overlay.fill('black')
+            for i, (label, value) in enumerate(lines):  # Текст окна не попадает в кэш текста и в замеры текста
+                label_text = self.font_16.render(label, True, 'white')
+                value_text = self.font_16.render(value, True, 'white')
+                self.profiler_overlay.blit(label_text, (8, 4 + 20 * i))
+                self.profiler_overlay.blit(value_text, (216 - value_text.get_width(), 4 + 20 * i))
+
+        position = (0, self.screen.get_height() - self.profiler_overlay.get_height())
+        rect = self.screen.blit(self.profiler_overlay, position)
+        pygame.display.update(rect)
+
+
+def coalesce_wheel(events):
+    """
+    Объединение серии прокруток колеса мыши в одной точке в одно событие
+
+    Каждое нажатие клавиши мыши получает атрибут clicks - количество объединённых прокруток (для клавиш - 1),
+    поэтому быстрая прокрутка обрабатывается за один проход, а не отдельно для каждого щелчка колеса
+    """
+    result = []
+    last_wheel = None  # Последняя прокрутка, к которой можно присоединить следующие
+    for event in events:
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if (event.button in (4, 5) and last_wheel is not None
+                    and (last_wheel.button, last_wheel.pos) == (event.button, event.pos)):
+                last_wheel.clicks += 1
+                continue
+            event = pygame.event.Event(event.type, event.dict, clicks=1)
+            last_wheel = event if event.button in (4, 5) else None
+        elif event.type not in (pygame.MOUSEWHEEL, pygame.MOUSEBUTTONUP):  # Сопутствующие прокрутке события
+            last_wheel = None
+        result.append(event)
+    return result
+
+
+class HitIndex:
+    """
+    Индекс областей экрана для поиска элемента под курсором
+
+    Экран делится на клетки cell_size x cell_size, и каждая область записывается во все клетки, которые задевает,
+    поэтому поиск просматривает только области одной клетки, сколько бы элементов ни было на экране
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}  # Клетка (x, y) -> [(область, обработчик, клавиши мыши)] в порядке добавления
+
+    def add(self, rect, handler, mouse_buttons=(1,)):
+        """
+        Добавление области, нажатия в которой передаются обработчику (более поздние области лежат сверху)
+        """
+        rect = pygame.Rect(rect)
+        for cell_y in range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1):
+            for cell_x in range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1):
+                self.cells.setdefault((cell_x, cell_y), []).append((rect, handler, mouse_buttons))
+
+    def find(self, pos, mouse_button):
+        """
+        Обработчик верхней области под точкой, принимающей нажатие клавиши мыши, или None
+        """
+        for rect, handler, mouse_buttons in reversed(self.cells.get((pos[0] // self.cell_size,
+                                                                     pos[1] // self.cell_size), ())):
+            if mouse_button in mouse_buttons and rect.collidepoint(pos):
+                return handler
+        return None
+
+    def dispatch(self, event):
+        """
+        Передача нажатия клавиши мыши обработчику области под курсором
+
+        Возвращает True, если такая область нашлась
+        """
+        handler = self.find(event.pos, event.button)
+        if handler is None:
+            return False
+        handler(event)
+        return True
+
+
+def place_buttons(buttons, x, y, index):
+    """
+    Расстановка кнопок столбцом (через 96 пикселей) и запись их областей в индекс
+    """
+    for i, button in enumerate(buttons):
+        button.rect = pygame.Rect(x, y + 96 * i, 320, 64)
+        index.add(button.rect, button.click, button.mouse_buttons)
+
+
+class TextCache:
+    """
+    Кэш отрисованного текста
+
+    Хранит не больше size строк и вытесняет те, что дольше всего не использовались
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        """
+        Отрисовка текста (каждая строка отрисовывается шрифтом только при первом использовании)
+        """
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = font.render(text, True, color)
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
 
 class Button:
     """
     Кнопка
     """
 
-    def __init__(self, application, text, active=True):
+    mouse_buttons = (1,)  # Клавиши мыши, нажатия которых принимает кнопка
+
+    def __init__(self, application, text, active=True, handler=None):
         self.app = application
         self.text = text  # Текст кнопки
         self.active = active
-        self.image = pygame.image.load(f'assets/button.png').convert_alpha()
+        self.handler = handler  # Действие при нажатии
+        self.rect = None  # Положение на экране (задаётся при расстановке кнопок)
+        self.image = load_image('assets/button.png')
+
+    def click(self, event):
+        """
+        Нажатие на кнопку
+        """
+        if self.active and self.handler:
+            self.handler()
 
     def draw(self, x, y):
         self.app.screen.blit(self.image, (x, y))  # Отрисовка изображения кнопки
 
         # Отрисовка текста кнопки
-        button_text = self.app.font_32.render(self.text, True, 'black' if self.active else 'gray')
+        button_text = self.app.text_cache.render(self.app.font_32, self.text, 'black' if self.active else 'gray')
         button_text_x = x + ((320 - button_text.get_width()) // 2)
         button_text_y = y + 8
         self.app.screen.blit(button_text, (button_text_x, button_text_y))
@@ -87,28 +363,37 @@ class GridSizeButton(Button):
     Кнопка изменения размера поля
     """
 
+    mouse_buttons = (1, 4, 5)
+
     def __init__(self, application, text):
         super().__init__(application, text)
-        self.image = pygame.image.load(f'assets/size_button.png').convert_alpha()
+        self.image = load_image('assets/size_button.png')
+
+    def click(self, event):
+        """
+        Изменение количества строк или столбцов: клик по "▲"/"▼" или колесо мыши
+        (с зажатым Shift размер меняется на 10)
+        """
+        step = (10 if pygame.key.get_mods() & pygame.KMOD_SHIFT else 1) * event.clicks
+        self.app.rows = change_size(self.app.rows, self.app.min_rows, self.app.max_rows,
+                                    self.rect.x + 209, *event.pos, event.button, step)
+        self.app.cols = change_size(self.app.cols, self.app.min_cols, self.app.max_cols,
+                                    self.rect.x + 277, *event.pos, event.button, step)
 
     def draw(self, x, y):
         self.app.screen.blit(self.image, (x, y))  # Отрисовка изображения кнопки
 
         # Отрисовка текста кнопки
-        button_text = self.app.font_32.render(self.text, True, 'black')
+        button_text = self.app.text_cache.render(self.app.font_32, self.text, 'black')
         button_text_x = x + ((210 - button_text.get_width()) // 2)
         button_text_y = y + 8
         self.app.screen.blit(button_text, (button_text_x, button_text_y))
 
-        # Отрисовка количества строк
-        rows_text = self.app.font_32.render(f'{self.app.rows}', True, 'black')
-        rows_x = x + 230 - rows_text.get_width() // 2
-        self.app.screen.blit(rows_text, (rows_x, 232))
-
-        # Отрисовка количества столбцов
-        cols_text = self.app.font_32.render(f'{self.app.cols}', True, 'black')
-        cols_x = x + 298 - cols_text.get_width() // 2
-        self.app.screen.blit(cols_text, (cols_x, 232))
+        # Отрисовка количества строк и столбцов (трёхзначные числа - уменьшенным шрифтом)
+        for value, center_x in ((self.app.rows, x + 230), (self.app.cols, x + 298)):
+            font = self.app.font_32 if value < 100 else self.app.font_24
+            value_text = self.app.text_cache.render(font, f'{value}', 'black')
+            self.app.screen.blit(value_text, (center_x - value_text.get_width() // 2, 255 - font.get_height() // 2))
 
 
 class TextButton(Button):
@@ -125,9 +410,9 @@ class TextButton(Button):
 
         # Отрисовка текстового поля
         if not self.text:
-            button_text = self.app.font_32_italic.render(self.hint, True, 'gray')
+            button_text = self.app.text_cache.render(self.app.font_32_italic, self.hint, 'gray')
         else:
-            button_text = self.app.font_32.render(self.text, True, 'black')
+            button_text = self.app.text_cache.render(self.app.font_32, self.text, 'black')
         button_text_x = x + ((320 - button_text.get_width()) // 2)
         button_text_y = y + 8
         self.app.screen.blit(button_text, (button_text_x, button_text_y))
@@ -139,7 +424,7 @@ class TextButton(Button):
         if event.key == pygame.K_BACKSPACE:  # Нажатие Backspace
             self.text = self.text[:-1]
         elif event.unicode.isalnum() or event.unicode in ' -_':  # Ввод букв, цифр и некоторых символов
-            text_width = self.app.font_32.render(self.text + event.unicode, True, 'black').get_width()
+            text_width = self.app.font_32.size(self.text + event.unicode)[0]
             if text_width <= 310:
                 self.text = (self.text + event.unicode).lstrip()
 
@@ -149,7 +434,7 @@ class Menu:
     Меню
     """
 
-    def __init__(self, application, title, buttons, bg_image):
+    def __init__(self, application, title, buttons, bg_image, button_y=160):
         self.app = application
         self.title = title
         self.buttons = buttons
@@ -157,34 +442,41 @@ class Menu:
 
         self.width, self.height = self.app.screen.get_size()
 
-        self.tint = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.tint.fill((0, 0, 0, 128))
+        self.index = HitIndex()  # Области кнопок меню
+        place_buttons(self.buttons, (self.width - 320) // 2, button_y, self.index)
 
-        self.button_x = (self.width - 320) // 2  # Положение кнопок меню по оси X
+    @cached_property
+    def tint(self):
+        """
+        Затемнение экрана под меню (создаётся при первом открытии меню)
+        """
+        tint = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        tint.fill((0, 0, 0, 128))
+        return tint
 
     def draw(self):
         self.app.screen.blit(self.tint, (0, 0))  # Затемнение экрана
         self.app.screen.blit(self.bg_image, ((self.width - 384) // 2, 64))  # Отрисовка фона меню
 
         # Отрисовка заголовка меню
-        title_text = self.app.font_45.render(self.title, True, 'black')
+        title_text = self.app.text_cache.render(self.app.font_45, self.title, 'black')
         title_x = (self.width - title_text.get_width()) // 2
         self.app.screen.blit(title_text, (title_x, 63))
 
         # Отрисовка кнопок меню
-        for i, button in enumerate(self.buttons):
-            button.draw(self.button_x, 160 + 96 * i)
+        for button in self.buttons:
+            button.draw(*button.rect.topleft)
 
 
-def change_size(value, min_value, max_value, button_x, x, y, mouse_button):
+def change_size(value, min_value, max_value, button_x, x, y, mouse_button, step=1):
     """
     Изменение размера поля
     """
     if button_x <= x <= button_x + 43:
         if 224 <= y <= 240 and mouse_button == 1 or mouse_button == 4:  # Клик по "▲" или колесо мыши вверх
-            return min(value + 1, max_value)
+            return min(value + step, max_value)
         elif 272 <= y <= 288 and mouse_button == 1 or mouse_button == 5:  # Клик по "▼" или колесо мыши вниз
-            return max(value - 1, min_value)
+            return max(value - step, min_value)
         else:
             return value
     else:
@@ -199,64 +491,47 @@ class MainMenu:
     def __init__(self, application):
         self.app = application
 
+        self.dirty = True  # Необходимость отрисовки
+        self.event_timeout = 1000  # Время ожидания событий в миллисекундах (None - без ожидания)
+
         self.new_game = False
 
         self.width, self.height = self.app.screen.get_size()  # Размер окна
 
-        self.menu_tint = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.menu_tint.fill((0, 0, 0, 128))  # Затемнение экрана
-
         self.menu_button_x = (self.width - 320) // 2  # Положение кнопок меню по оси X
 
         self.main_menu_buttons = [
-            Button(self.app, 'Новая игра'),
+            Button(self.app, 'Новая игра', handler=self.open_new_game),
             GridSizeButton(self.app, 'Размер поля'),
-            Button(self.app, 'Таблица рекордов'),
-            Button(self.app, 'Выйти из игры')
+            Button(self.app, 'Таблица рекордов', handler=self.open_leaderboard),
+            Button(self.app, 'Выйти из игры', handler=self.quit)
         ]
+        self.main_menu_index = HitIndex()  # Области кнопок главного меню
+        place_buttons(self.main_menu_buttons, self.menu_button_x, 128, self.main_menu_index)
 
         self.new_game_menu_buttons = [
             TextButton(self.app, self.app.player_name, 'Введите имя'),
-            Button(self.app, 'Начать игру', bool(self.app.player_name)),
-            Button(self.app, 'Вернуться в меню')
+            Button(self.app, 'Начать игру', bool(self.app.player_name), self.start_game),
+            Button(self.app, 'Вернуться в меню', handler=self.close_new_game)
         ]
-        self.new_game_menu_bg = pygame.image.load('assets/new_game_menu_bg.png').convert_alpha()
+        self.new_game_menu_bg = load_image('assets/new_game_menu_bg.png')
         self.new_game_menu = Menu(self.app, 'Новая игра', self.new_game_menu_buttons, self.new_game_menu_bg)
 
+        # Подготовка полей (с заданным начальным значением - одного поля с этим значением)
+        self.app.board_pool.prepare(self.app.rows, self.app.cols, self.app.difficulty, self.app.seed)
+
     def event_handler(self, event):
         """
         Обработка событий
         """
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            x, y = pygame.mouse.get_pos()
-
-            # Обычное состояние главного меню
-            if self.menu_button_x <= x <= self.menu_button_x + 320 and not self.new_game:
-
-                if 128 <= y <= 192 and event.button == 1:  # Клик по "Новая игра"
-                    self.new_game = True
-
-                elif 224 <= y <= 288:  # "Размер поля"
-                    self.app.rows = change_size(self.app.rows, self.app.min_rows, self.app.max_rows,
-                                                self.menu_button_x + 209, x, y, event.button)
-                    self.app.cols = change_size(self.app.cols, self.app.min_cols, self.app.max_cols,
-                                                self.menu_button_x + 277, x, y, event.button)
-
-                elif 320 <= y <= 384 and event.button == 1:  # Клик по "Таблица рекордов"
-                    self.app.state = Leaderboard(self.app)
+        size = (self.app.rows, self.app.cols)
 
-                elif 416 <= y <= 480 and event.button == 1:  # Клик по "Выйти из игры"
-                    self.app.running = False
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
+            self.dirty = True  # Действие игрока может изменить изображение
 
-            # Меню новой игры
-            elif self.menu_button_x <= x <= self.menu_button_x + 320 and self.new_game and event.button == 1:
-                if 256 <= y <= 320 and self.new_game_menu_buttons[1].active:  # Клик по "Начать игру"
-                    app.player_name = self.new_game_menu_buttons[0].text.strip()
-                    self.app.state = Game(self.app)
-                elif 352 <= y <= 416:  # Клик по "Вернуться в меню"
-                    self.new_game = False
-                    self.new_game_menu_buttons[0].text = self.app.player_name
-                    self.new_game_menu_buttons[1].active = bool(self.app.player_name)
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            # Нажатие передаётся кнопке под курсором в открытом меню
+            (self.new_game_menu.index if self.new_game else self.main_menu_index).dispatch(event)
 
         elif event.type == pygame.KEYDOWN:
 
@@ -264,35 +539,32 @@ class MainMenu:
             if not self.new_game:
 
                 if event.key == pygame.K_RETURN:  # Нажатие Enter
-                    self.new_game = True
+                    self.open_new_game()
 
-                elif event.key == pygame.K_UP:  # Нажатие стрелки вверх
-                    self.app.rows = min(self.app.rows + 1, self.app.max_rows)
+                elif event.key == pygame.K_UP:  # Нажатие стрелки вверх (с зажатым Shift размер меняется на 10)
+                    self.app.rows = min(self.app.rows + (10 if event.mod & pygame.KMOD_SHIFT else 1), self.app.max_rows)
                 elif event.key == pygame.K_DOWN:  # Нажатие стрелки вниз
-                    self.app.rows = max(self.app.rows - 1, self.app.min_rows)
+                    self.app.rows = max(self.app.rows - (10 if event.mod & pygame.KMOD_SHIFT else 1), self.app.min_rows)
 
                 elif event.key == pygame.K_RIGHT:  # Нажатие стрелки вправо
-                    self.app.cols = min(self.app.cols + 1, self.app.max_cols)
+                    self.app.cols = min(self.app.cols + (10 if event.mod & pygame.KMOD_SHIFT else 1), self.app.max_cols)
                 elif event.key == pygame.K_LEFT:  # Нажатие стрелки влево
-                    self.app.cols = max(self.app.cols - 1, self.app.min_cols)
+                    self.app.cols = max(self.app.cols - (10 if event.mod & pygame.KMOD_SHIFT else 1), self.app.min_cols)
 
                 elif event.key == pygame.K_TAB:  # Нажатие Tab
-                    self.app.state = Leaderboard(self.app)
+                    self.open_leaderboard()
 
                 elif event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                    self.app.running = False
+                    self.quit()
 
             # Меню новой игры
             elif self.new_game:
 
                 if event.key == pygame.K_RETURN and self.new_game_menu_buttons[1].active:  # Нажатие Enter
-                    app.player_name = self.new_game_menu_buttons[0].text.strip()
-                    self.app.state = Game(self.app)
+                    self.start_game()
 
                 elif event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                    self.new_game = False
-                    self.new_game_menu_buttons[0].text = self.app.player_name
-                    self.new_game_menu_buttons[1].active = bool(self.app.player_name)
+                    self.close_new_game()
 
                 else:  # Обработка ввода с клавиатуры
                     self.new_game_menu_buttons[0].keyboard_input(event)
@@ -301,11 +573,47 @@ class MainMenu:
                     elif self.new_game_menu_buttons[0].text.strip() and not self.new_game_menu_buttons[1].active:
                         self.new_game_menu_buttons[1].active = True
 
+        if (self.app.rows, self.app.cols) != size:  # Подготовка полей нового размера
+            self.app.board_pool.prepare(self.app.rows, self.app.cols, self.app.difficulty, self.app.seed)
+
+    def open_new_game(self):
+        """
+        Открытие меню новой игры
+        """
+        self.new_game = True
+
+    def close_new_game(self):
+        """
+        Возврат из меню новой игры в главное меню (введённое имя не сохраняется)
+        """
+        self.new_game = False
+        self.new_game_menu_buttons[0].text = self.app.player_name
+        self.new_game_menu_buttons[1].active = bool(self.app.player_name)
+
+    def start_game(self):
+        """
+        Начало игры с введённым именем
+        """
+        self.app.player_name = self.new_game_menu_buttons[0].text.strip()
+        self.app.state = new_game(self.app)
+
+    def open_leaderboard(self):
+        """
+        Переход к таблице рекордов
+        """
+        self.app.state = Leaderboard(self.app)
+
+    def quit(self):
+        """
+        Выход из игры
+        """
+        self.app.running = False
+
     def loop(self):
         """
         Цикл главного меню
         """
-        self.app.clock.tick(60)  # Ограничение FPS до 60
+        self.app.clock.tick(self.app.fps)  # Ограничение FPS
 
     def render(self):
         """
@@ -314,12 +622,12 @@ class MainMenu:
         self.app.screen.fill('white')  # Заливка экрана белым цветом, чтобы избавиться от прошлого кадра
 
         # Отрисовка названия игры
-        title_text = self.app.font_64.render('Трубопровод', True, 'black')
+        title_text = self.app.text_cache.render(self.app.font_64, 'Трубопровод', 'black')
         self.app.screen.blit(title_text, ((self.width - title_text.get_width()) // 2, 8))
 
         # Отрисовка кнопок главного меню
-        for i, button in enumerate(self.main_menu_buttons):
-            button.draw(self.menu_button_x, 128 + 96 * i)
+        for button in self.main_menu_buttons:
+            button.draw(*button.rect.topleft)
 
         # Отрисовка меню новой игры
         if self.new_game:
@@ -336,69 +644,109 @@ class Leaderboard:
     def __init__(self, application):
         self.app = application
 
+        self.dirty = True  # Необходимость отрисовки
+        self.event_timeout = 1000  # Время ожидания событий в миллисекундах (None - без ожидания)
+
         self.width, self.height = 1088, 640
 
-        if pygame.display.get_window_size() != (self.width, self.height):  # Размер окна не соответствует требуемому
-            pygame.display.quit()
-            self.app.screen = pygame.display.set_mode((self.width, self.height))
-            pygame.display.set_caption('Игра "Трубопровод"')
-            pygame.display.set_icon(pygame.image.load('assets/icon.png'))
+        self.app.resize(self.width, self.height)
+
+        self.leaderboard_bg = load_image('assets/leaderboard_bg.png')
+        self.first_page_button = load_image('assets/first_page_button.png')
+        self.previous_page_button = load_image('assets/previous_page_button.png')
+        self.next_page_button = load_image('assets/next_page_button.png')
+        self.last_page_button = load_image('assets/last_page_button.png')
+        self.back_button = load_image('assets/back_button.png')
+
+        self.sizes = [None] + self.app.scores.sizes()  # Фильтры по размеру поля (None - все поля)
+        self.size = None  # Размер поля, рекорды на котором показываются
+        self.order = 'score'  # Порядок сортировки: 'score', 'time' или 'turns'
+        self.set_view(None, 'score')
+
+        # Области нажатий: кнопка возврата в меню, названия столбцов (порядок сортировки и фильтр по размеру поля),
+        # таблица (прокрутка колесом мыши) и кнопки страниц
+        self.index = HitIndex()
+        self.index.add((0, 0, 64, 64), lambda event: self.back())
+        self.index.add((448, 64, 192, 64), lambda event: self.set_view(self.size, 'score'))
+        self.index.add((640, 64, 128, 64), lambda event: self.next_size(1 if event.button == 1 else -1), (1, 3))
+        self.index.add((768, 64, 128, 64), lambda event: self.set_view(self.size, 'time'))
+        self.index.add((896, 64, 128, 64), lambda event: self.set_view(self.size, 'turns'))
+        self.index.add((64, 128, 960, 448), self.wheel, (4, 5))
+        self.index.add((64, 576, 64, 64), lambda event: self.scroll(-self.last_page))
+        self.index.add((128, 576, 64, 64), lambda event: self.scroll(-1))
+        self.index.add((896, 576, 64, 64), lambda event: self.scroll(1))
+        self.index.add((960, 576, 64, 64), lambda event: self.scroll(self.last_page))
+
+    def set_view(self, size, order):
+        """
+        Переключение фильтра по размеру поля и порядка сортировки
+        """
+        self.size, self.order = size, order
+        scores_count = self.app.scores.count(self.size)
+        self.last_page = (scores_count - 1) // 7 + 1 if scores_count > 0 else 1
+        self.page = 1
 
-        self.leaderboard_bg = pygame.image.load('assets/leaderboard_bg.png').convert_alpha()
-        self.first_page_button = pygame.image.load('assets/first_page_button.png').convert_alpha()
-        self.previous_page_button = pygame.image.load('assets/previous_page_button.png').convert_alpha()
-        self.next_page_button = pygame.image.load('assets/next_page_button.png').convert_alpha()
-        self.last_page_button = pygame.image.load('assets/last_page_button.png').convert_alpha()
-        self.back_button = pygame.image.load('assets/back_button.png').convert_alpha()
+    def scroll(self, pages):
+        """
+        Переход на pages страниц вперёд (pages > 0) или назад (pages < 0)
+        """
+        self.page = min(max(self.page + pages, 1), self.last_page)
 
-        self.sorted_scores = sorted(self.app.scores.items(), key=lambda item: item[1]['score'], reverse=True)
+    def wheel(self, event):
+        """
+        Прокрутка страниц колесом мыши (серия прокруток перелистывает несколько страниц)
+        """
+        self.scroll(event.clicks if event.button == 5 else -event.clicks)
 
-        self.last_page = (len(self.sorted_scores) - 1) // 7 + 1 if len(self.sorted_scores) > 0 else 1
-        self.page = 1
+    def back(self):
+        """
+        Возврат в главное меню
+        """
+        self.app.state = MainMenu(self.app)
+
+    def next_size(self, step):
+        """
+        Переключение фильтра на следующий (step = 1) или предыдущий (step = -1) размер поля
+        """
+        self.set_view(self.sizes[(self.sizes.index(self.size) + step) % len(self.sizes)], self.order)
 
     def event_handler(self, event):
         """
         Обработка событий
         """
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            x, y = pygame.mouse.get_pos()
-
-            if 0 <= x <= 64 and 0 <= y <= 64 and event.button == 1:  # Клик по кнопке возврата в меню
-                self.app.state = MainMenu(self.app)
-
-            elif 64 <= x <= 1024 and 128 <= y <= 576 and event.button == 4:  # Прокрутка колеса мыши вверх
-                self.page = max(self.page - 1, 1)
-            elif 64 <= x <= 1024 and 128 <= y <= 576 and event.button == 5:  # Прокрутка колеса мыши вниз
-                self.page = min(self.page + 1, self.last_page)
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
+            self.dirty = True  # Действие игрока может изменить изображение
 
-            elif 64 <= x <= 128 and 576 <= y <= 640 and event.button == 1:  # Клик по кнопке первой страницы
-                self.page = 1
-            elif 128 <= x <= 192 and 576 <= y <= 640 and event.button == 1:  # Клик по кнопке предыдущей страницы
-                self.page = max(self.page - 1, 1)
-            elif 896 <= x <= 960 and 576 <= y <= 640 and event.button == 1:  # Клик по кнопке следующей страницы
-                self.page = min(self.page + 1, self.last_page)
-            elif 960 <= x <= 1024 and 576 <= y <= 640 and event.button == 1:  # Клик по кнопке последней страницы
-                self.page = self.last_page
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            self.index.dispatch(event)  # Нажатие передаётся области под курсором
 
         elif event.type == pygame.KEYDOWN:
 
             if event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                self.app.state = MainMenu(self.app)
+                self.back()
 
             elif event.key == pygame.K_HOME:  # Нажатие Home
-                self.page = 1
+                self.scroll(-self.last_page)
             elif event.key == pygame.K_LEFT:  # Нажатие стрелки влево
-                self.page = max(self.page - 1, 1)
+                self.scroll(-1)
             elif event.key == pygame.K_RIGHT:  # Нажатие стрелки вправо
-                self.page = min(self.page + 1, self.last_page)
+                self.scroll(1)
             elif event.key == pygame.K_END:  # Нажатие End
-                self.page = self.last_page
+                self.scroll(self.last_page)
+
+            elif event.key == pygame.K_UP:  # Нажатие стрелки вверх
+                self.next_size(-1)
+            elif event.key == pygame.K_DOWN:  # Нажатие стрелки вниз
+                self.next_size(1)
+            elif event.key == pygame.K_TAB:  # Нажатие Tab
+                orders = ['score', 'time', 'turns']
+                self.set_view(self.size, orders[(orders.index(self.order) + 1) % len(orders)])
 
     def loop(self):
         """
         Цикл таблицы рекордов
         """
-        self.app.clock.tick(60)  # Ограничение FPS до 60
+        self.app.clock.tick(self.app.fps)  # Ограничение FPS
 
     def render(self):
         """
@@ -408,48 +756,56 @@ class Leaderboard:
 
         self.app.screen.blit(self.leaderboard_bg, (64, 0))  # Отрисовка фона таблицы рекордов
 
-        title_text = self.app.font_45.render('Таблица рекордов', True, 'black')
+        title_text = self.app.text_cache.render(self.app.font_45, 'Таблица рекордов', 'black')
         self.app.screen.blit(title_text, ((self.width - title_text.get_width()) // 2, -1))  # Отрисовка названия таблицы
 
         # Отрисовка названий столбцов
-        number_title = self.app.font_32.render('№', True, 'black')
+        number_title = self.app.text_cache.render(self.app.font_32, '№', 'black')
         self.app.screen.blit(number_title, ((64 - number_title.get_width()) // 2 + 64, 72))
-        name_title = self.app.font_32.render('Имя', True, 'black')
+        name_title = self.app.text_cache.render(self.app.font_32, 'Имя', 'black')
         self.app.screen.blit(name_title, ((320 - name_title.get_width()) // 2 + 128, 72))
-        score_title = self.app.font_32.render('Счёт', True, 'black')
+        score_title = self.app.text_cache.render(self.app.font_32, 'Счёт', 'black')
         self.app.screen.blit(score_title, ((192 - score_title.get_width()) // 2 + 448, 72))
-        size_title = self.app.font_32.render('Поле', True, 'black')
+        size_title = self.app.text_cache.render(self.app.font_32, self.size or 'Поле', 'black')
         self.app.screen.blit(size_title, ((128 - size_title.get_width()) // 2 + 640, 72))
-        time_title = self.app.font_32.render('Время', True, 'black')
+        time_title = self.app.text_cache.render(self.app.font_32, 'Время', 'black')
         self.app.screen.blit(time_title, ((128 - time_title.get_width()) // 2 + 768, 72))
-        turns_title = self.app.font_32.render('Ходы', True, 'black')
+        turns_title = self.app.text_cache.render(self.app.font_32, 'Ходы', 'black')
         self.app.screen.blit(turns_title, ((128 - turns_title.get_width()) // 2 + 896, 72))
 
-        for i in range(7 * self.page - 7, min(7 * self.page, len(self.sorted_scores))):
-            name = self.sorted_scores[i][0]
-            score = self.sorted_scores[i][1]['score']
-            size = self.sorted_scores[i][1]['size']
-            time = self.sorted_scores[i][1]['time']
-            turns = self.sorted_scores[i][1]['turns']
+        # Подчёркивание названия столбца, по которому отсортированы рекорды
+        order_x, order_width, order_title = {'score': (448, 192, score_title), 'time': (768, 128, time_title),
+                                             'turns': (896, 128, turns_title)}[self.order]
+        order_x += (order_width - order_title.get_width()) // 2
+        pygame.draw.line(self.app.screen, 'black', (order_x, 118), (order_x + order_title.get_width(), 118), 2)
+
+        for i, (name, record) in enumerate(self.app.scores.top(7 * self.page - 7, 7, self.size, self.order),
+                                           7 * self.page - 7):
+            score = record['score']
+            size = record['size']
+            time = record['time']
+            turns = record['turns']
 
             # Отрисовка данных о рекордах
-            number_text = self.app.font_32.render(f'{i + 1}', True, 'black')
+            number_text = self.app.text_cache.render(self.app.font_32, f'{i + 1}', 'black')
             self.app.screen.blit(number_text, ((64 - number_text.get_width()) // 2 + 64, 136 + 64 * (i % 7)))
-            name_text = self.app.font_32.render(f'{name}', True, 'black')
+            name_text = self.app.text_cache.render(self.app.font_32, f'{name}', 'black')
             self.app.screen.blit(name_text, ((320 - name_text.get_width()) // 2 + 128, 136 + 64 * (i % 7)))
-            score_text = self.app.font_32.render(f'{score}', True, 'black')
+            # Счёт рекорда старого формата посчитан по другой формуле и показывается серым
+            score_color = 'gray' if record['legacy'] else 'black'
+            score_text = self.app.text_cache.render(self.app.font_32, f'{score}', score_color)
             self.app.screen.blit(score_text, ((192 - score_text.get_width()) // 2 + 448, 136 + 64 * (i % 7)))
-            size_text = self.app.font_32.render(f'{size}', True, 'black')
+            size_text = self.app.text_cache.render(self.app.font_32, f'{size}', 'black')
             self.app.screen.blit(size_text, ((128 - size_text.get_width()) // 2 + 640, 136 + 64 * (i % 7)))
-            time_text = self.app.font_32.render(f'{time}', True, 'black')
+            time_text = self.app.text_cache.render(self.app.font_32, f'{time}', 'black')
             self.app.screen.blit(time_text, ((128 - time_text.get_width()) // 2 + 768, 136 + 64 * (i % 7)))
-            turns_text = self.app.font_32.render(f'{turns}', True, 'black')
+            turns_text = self.app.text_cache.render(self.app.font_32, f'{turns}', 'black')
             self.app.screen.blit(turns_text, ((128 - turns_text.get_width()) // 2 + 896, 136 + 64 * (i % 7)))
 
         self.app.screen.blit(self.first_page_button, (72, 584))  # Отрисовка кнопки первой страницы
         self.app.screen.blit(self.previous_page_button, (136, 584))  # Отрисовка кнопки предыдущей страницы
 
-        page_text = self.app.font_32.render(f'Страница {self.page} из {self.last_page}', True, 'black')
+        page_text = self.app.text_cache.render(self.app.font_32, f'Страница {self.page} из {self.last_page}', 'black')
         self.app.screen.blit(page_text, ((self.width - page_text.get_width()) // 2, 584))  # Отрисовка номера страницы
 
         self.app.screen.blit(self.next_page_button, (904, 584))  # Отрисовка кнопки следующей страницы
@@ -460,70 +816,61 @@ class Leaderboard:
         pygame.display.flip()  # Отображение изменений на экране
 
 
-class Tile:
+def new_game(application):
     """
-    Фишка
+    Состояние новой игры: игра, если поле уже готово, иначе ожидание поля
     """
+    prepared = application.board_pool.take(application.rows, application.cols, application.difficulty,
+                                           application.seed)
+    return BoardPreparation(application) if prepared is None else Game(application, prepared=prepared)
 
-    def __init__(self, pipe, angle):
-        self.pipe = pipe  # Тип трубы
-        self.angle = angle  # Угол поворота фишки
-        self.image = pygame.image.load(f'assets/pipes/{pipe}.png').convert_alpha()
 
-    def __add__(self, angle):
+class BoardPreparation:
+    """
+    Ожидание поля, которое генерируется в фоновом процессе
+
+    Генерация и решение большого поля занимают секунды, поэтому окно в это время продолжает обрабатывать события
+    """
+
+    def __init__(self, application):
+        self.app = application
+
+        self.dirty = True  # Необходимость отрисовки
+        self.event_timeout = 50  # Готовность поля проверяется после каждого ожидания событий
+
+        self.width, self.height = self.app.screen.get_size()  # Размер окна
+
+    def event_handler(self, event):
         """
-        Поворот фишки против часовой стрелки
+        Обработка событий
         """
-        self.angle = (self.angle + angle) % 360
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:  # Нажатие Escape
+            self.app.state = MainMenu(self.app)
 
-    def __sub__(self, angle):
+    def loop(self):
         """
-        Поворот фишки по часовой стрелке
+        Проверка готовности поля
         """
-        self.angle = (self.angle - angle) % 360
+        self.app.clock.tick(self.app.fps)  # Ограничение FPS
+        prepared = self.app.board_pool.take(self.app.rows, self.app.cols, self.app.difficulty, self.app.seed)
+        if prepared is not None:
+            self.app.state = Game(self.app, prepared=prepared)
 
-    def water_direction(self, direction):
+    def render(self):
         """
-        Определение направления, в котором будет двигаться вода
+        Отрисовка ожидания поля
         """
-        if self.pipe == 'straight':  # Фишка с прямой трубой
-            if direction == 'right' and self.angle % 180 == 0:
-                return 'right'
-            elif direction == 'left' and self.angle % 180 == 0:
-                return 'left'
-            elif direction == 'down' and self.angle % 180 == 90:
-                return 'down'
-            elif direction == 'up' and self.angle % 180 == 90:
-                return 'up'
-
-        elif self.pipe == 'bend':  # Фишка с коленом
-            if direction == 'right' and self.angle == 0 or direction == 'left' and self.angle == 90:
-                return 'down'
-            elif direction == 'right' and self.angle == 270 or direction == 'left' and self.angle == 180:
-                return 'up'
-            elif direction == 'down' and self.angle == 180 or direction == 'up' and self.angle == 90:
-                return 'right'
-            elif direction == 'down' and self.angle == 270 or direction == 'up' and self.angle == 0:
-                return 'left'
-
-        elif self.pipe == 'cross':  # Фишка с двумя противоположными коленами
-            if direction == 'right' and self.angle % 180 == 0 or direction == 'left' and self.angle % 180 == 90:
-                return 'down'
-            elif direction == 'right' and self.angle % 180 == 90 or direction == 'left' and self.angle % 180 == 0:
-                return 'up'
-            elif direction == 'down' and self.angle % 180 == 0 or direction == 'up' and self.angle % 180 == 90:
-                return 'right'
-            elif direction == 'down' and self.angle % 180 == 90 or direction == 'up' and self.angle % 180 == 0:
-                return 'left'
+        self.app.screen.fill('white')  # Заливка экрана белым цветом, чтобы избавиться от прошлого кадра
 
-        elif self.pipe == 'end' and (direction == 'right' and self.angle == 0 or  # Фишка с концом трубы
-                                     direction == 'left' and self.angle == 180 or
-                                     direction == 'down' and self.angle == 270 or
-                                     direction == 'up' and self.angle == 90):
-            return 'end'
+        # Отрисовка заголовка, размера поля и подсказки
+        title_text = self.app.text_cache.render(self.app.font_45, 'Подготовка поля', 'black')
+        self.app.screen.blit(title_text, ((self.width - title_text.get_width()) // 2, self.height // 2 - 112))
+        size_text = self.app.text_cache.render(self.app.font_32, f'{self.app.rows}x{self.app.cols}', 'black')
+        self.app.screen.blit(size_text, ((self.width - size_text.get_width()) // 2, self.height // 2 - 40))
+        hint_text = self.app.text_cache.render(self.app.font_32_italic, 'Escape - выход в меню', 'gray')
+        self.app.screen.blit(hint_text, ((self.width - hint_text.get_width()) // 2, self.height // 2 + 32))
 
-        else:
-            return None
+        pygame.display.flip()  # Отображение изменений на экране
 
 
 class Game:
@@ -531,256 +878,617 @@ class Game:
     Игровой процесс
     """
 
-    def __init__(self, application):
+    def __init__(self, application, record=None, prepared=None):
         self.app = application
 
+        self.dirty = True  # Необходимость отрисовки
+        self.event_timeout = None  # Время ожидания событий в миллисекундах (None - без ожидания); задаётся циклом
+
         self.pause = False
-        self.win = False
         self.high_score = False
-
-        self.scale = 16 * (min(576 // self.app.rows, 1152 // self.app.cols) // 16)  # Размер фишки
-        self.grid_width, self.grid_height = self.app.cols * self.scale, self.app.rows * self.scale  # Размер поля
-        self.width, self.height = max(self.grid_width, 512), max(self.grid_height, 512) + 64  # Размер окна
-        self.grid_x = (self.width - self.grid_width) // 2  # Положение поля по оси X
-        self.grid_y = (self.height - self.grid_height + 64) // 2  # Положение поля по оси Y
-
-        if pygame.display.get_window_size() != (self.width, self.height):  # Размер окна не соответствует требуемому
-            pygame.display.quit()
-            self.app.screen = pygame.display.set_mode((self.width, self.height))
-            pygame.display.set_caption('Игра "Трубопровод"')
-            pygame.display.set_icon(pygame.image.load('assets/icon.png'))
-
-        self.start_x, self.start_y = 0, 0  # Положение начальной фишки
-        self.end_x, self.end_y = self.app.cols - 1, self.app.rows - 1  # Положение конечной фишки
-
-        self.tiles = [[Tile(choice(['straight', 'bend', 'cross']), choice([0, 90, 180, 270]))  # Генерация фишек
-                       for _ in range(self.app.cols)] for _ in range(self.app.rows)]
-        self.tiles[self.start_y][self.start_x] = Tile('start', 0)  # Начальная фишка
-        self.tiles[self.end_y][self.end_x] = Tile('end', 0)  # Конечная фишка
-
-        self.water = []
-
+        self.rank = None  # Место рекорда игрока в таблице рекордов
+
+        self.replay = record is not None  # Воспроизведение записи игры (ходы игрока и рекорды отключены)
+        self.replay_running = True
+        self.replay_speed = 8  # Скорость воспроизведения в ходах в секунду
+        self.replay_progress = 0  # Накопленная доля следующего хода записи
+        if self.replay:
+            board, moves = load_record(record)
+            self.app.rows, self.app.cols = board.rows, board.cols  # Размер поля записи
+
+        # Размер фишки: поле помещается в окно целиком, а большие поля показываются частично
+        scale = max(16 * (min(576 // self.app.rows, 1152 // self.app.cols) // 16), 32)
+        self.width = max(min(self.app.cols * scale, 1152), 512)  # Размер окна
+        self.height = max(min(self.app.rows * scale, 576), 512) + 64
+
+        self.app.resize(self.width, self.height)
+
+        if self.replay:
+            optimal_turns, self.seed = None, None
+        else:  # Поле, подготовленное в фоновом процессе: (поле, минимальное количество ходов, начальное значение)
+            board, optimal_turns, self.seed = prepared
+        self.engine = Engine(board, optimal_turns)
+        if self.replay:
+            self.engine.pause()  # Время воспроизведения не считается временем игры
+            self.engine.moves = moves  # Ходы записи выполняются как повтор отменённых ходов
+
+        self.chunks = OrderedDict()  # Кэш отрисованных блоков поля: (x, y) блока -> поверхность
+        self.dirty_tiles = set()  # Фишки для перерисовки (блоки без кэша отрисовываются целиком)
+        self.scale = None
+        self.camera_x, self.camera_y = 0, 0  # Положение видимой области на поле
+        self.show_dead = False  # Выделение фишек, через которые вода не может пройти ни при каком повороте
+        self.dead_tiles = None  # Массив мёртвых фишек (не зависит от поворотов, поэтому считается один раз)
+        self.pending_moves = []  # Ходы игрока за текущий кадр: [(x, y, turns)]
+        self.hint_board = None  # Фишки поля, для которого ищется подсказка (None - подсказка не ищется)
+        self.hint_result = None  # Найденная подсказка: (фишки поля, ход или None); записывается потоком пула
+        self.set_scale(scale)
+        self.redraw = True  # Необходимость полной перерисовки экрана
+        self.rendered_mode = None  # Состояние (пауза, победа) на момент последней отрисовки
+        self.rendered_header = None  # Значения заголовка на момент последней отрисовки
+
+        self.pipe_images = {
+            'start': load_image('assets/pipes/start.png'),
+            'straight': load_image('assets/pipes/straight.png'),
+            'bend': load_image('assets/pipes/bend.png'),
+            'cross': load_image('assets/pipes/cross.png'),
+            'end': load_image('assets/pipes/end.png')
+        }
         self.water_images = {
-            'start': pygame.image.load('assets/pipes/start_water.png').convert_alpha(),
-            'straight': pygame.image.load('assets/pipes/straight_water.png').convert_alpha(),
-            'bend': pygame.image.load('assets/pipes/bend_water.png').convert_alpha(),
-            'cross': pygame.image.load('assets/pipes/cross_water.png').convert_alpha(),
-            'end': pygame.image.load('assets/pipes/end_water.png').convert_alpha()
+            'start': load_image('assets/pipes/start_water.png'),
+            'straight': load_image('assets/pipes/straight_water.png'),
+            'bend': load_image('assets/pipes/bend_water.png'),
+            'cross': load_image('assets/pipes/cross_water.png'),
+            'end': load_image('assets/pipes/end_water.png')
         }
 
-        self.menu_tint = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.menu_tint.fill((0, 0, 0, 128))  # Затемнение экрана
-
-        self.menu_button_x = (self.width - 320) // 2  # Положение кнопок меню по оси X
-
-        self.pause_button = pygame.image.load('assets/pause_button.png').convert_alpha()
+        self.pause_button = load_image('assets/pause_button.png')
         self.pause_menu_buttons = [
-            Button(self.app, 'Продолжить'),
-            Button(self.app, 'Выйти в меню')
+            Button(self.app, 'Продолжить', handler=lambda: self.set_pause(False)),
+            Button(self.app, 'Выйти в меню', handler=self.exit_to_menu)
         ]
-        self.pause_menu_bg = pygame.image.load('assets/pause_menu_bg.png').convert_alpha()
+        self.pause_menu_bg = load_image('assets/pause_menu_bg.png')
         self.pause_menu = Menu(self.app, 'Пауза', self.pause_menu_buttons, self.pause_menu_bg)
 
         self.win_menu_buttons = [
-            Button(self.app, 'Играть ещё раз'),
-            Button(self.app, 'Выйти в меню')
+            Button(self.app, 'Играть ещё раз', handler=self.play_again),
+            Button(self.app, 'Выйти в меню', handler=self.exit_to_menu)
         ]
-        self.win_menu_bg = pygame.image.load('assets/win_menu_bg.png').convert_alpha()
-
-        self.time = 0
-        self.turns = 0
-        self.score = 0
-
-        self.check_win()
-
-    def check_win(self):
-        """
-        Проверка победной ситуации
-        """
-        direction = None
-        x, y = self.start_x, self.start_y
-        self.water = [[x, y, 'start']]  # Список координат труб с водой
-
-        if self.tiles[y][x].angle == 0:
-            direction = 'right'
-            x += 1
-        elif self.tiles[y][x].angle == 90:
-            direction = 'up'
-            y -= 1
-        elif self.tiles[y][x].angle == 180:
-            direction = 'left'
-            x -= 1
-        elif self.tiles[y][x].angle == 270:
-            direction = 'down'
-            y += 1
-
-        while 0 <= x <= self.app.cols - 1 and 0 <= y <= self.app.rows - 1 and direction:
-            direction = self.tiles[y][x].water_direction(direction)  # Определение направления движения воды
-
-            if direction:
-                pipe = self.tiles[y][x].pipe  # Тип трубы
-                if pipe == 'cross' and (self.tiles[y][x].angle == 0 and (direction in ['down', 'left']) or
-                                        self.tiles[y][x].angle == 90 and (direction in ['down', 'right']) or
-                                        self.tiles[y][x].angle == 180 and (direction in ['up', 'right']) or
-                                        self.tiles[y][x].angle == 270 and (direction in ['up', 'left'])):
-                    pipe = 'bend'  # Вода движется по нижнему колену (в остальных случаях - по верхнему)
-
-                self.water.append([x, y, pipe])  # Добавление координат трубы с водой в список
-
-                if direction == 'right':
-                    x += 1
-                elif direction == 'left':
-                    x -= 1
-                elif direction == 'up':
-                    y -= 1
-                elif direction == 'down':
-                    y += 1
-                elif direction == 'end':  # Вода достигла конечной фишки
-                    self.win = True
-                    time = self.time // 60 if self.time > 60 else 1
-                    turns = self.turns if self.turns > 0 else 1
-                    self.score = (self.app.rows ** 2 * self.app.cols ** 2 * 100) // (time * turns)
-                    if (self.app.player_name not in self.app.scores
-                            or self.score > self.app.scores[self.app.player_name]['score']):
-                        self.high_score = True
-                        self.app.scores[self.app.player_name] = {'score': self.score,
-                                                                 'size': f'{self.app.rows}x{self.app.cols}',
-                                                                 'time': f'{self.time // 3600:02}:'
-                                                                         f'{self.time // 60 % 60:02}',
-                                                                 'turns': self.turns}
-                    break
+        self.win_menu_bg = load_image('assets/win_menu_bg.png')
+        # Заголовок, счёт, место в таблице и начальное значение отрисовываются при отрисовке игры
+        self.win_menu = Menu(self.app, '', self.win_menu_buttons, self.win_menu_bg, 224)
+
+    def get_sprite(self, pipe, angle, water=False):
+        """
+        Получение повёрнутого и масштабированного изображения трубы из кэша
+        """
+        key = (pipe, angle, self.scale, water)
+        if key not in self.app.sprites:  # Изображение ещё не использовалось
+            image = self.water_images[pipe] if water else self.pipe_images[pipe]
+            self.app.sprites[key] = pygame.transform.scale(pygame.transform.rotate(image, angle),
+                                                           (self.scale, self.scale))
+        return self.app.sprites[key]
+
+    def rotate_tile(self, tile_x, tile_y, turns):
+        """
+        Поворот фишки игроком
+
+        Ход откладывается до конца обработки событий кадра (apply_moves), чтобы серия кликов
+        пересчитывала путь воды один раз
+        """
+        if self.replay:
+            return
+        self.pending_moves.append((tile_x, tile_y, turns))
+
+    def apply_moves(self):
+        """
+        Выполнение отложенных ходов кадра
+        """
+        if self.pending_moves:
+            self.engine.rotate_many(self.pending_moves)
+            self.pending_moves.clear()
+            if self.engine.win:
+                self.save_score()
+
+    def step(self, direction):
+        """
+        Отмена хода (direction = -1) или повтор отменённого хода или хода записи (direction = 1)
+
+        Возвращает координаты фишки или None, если ходов нет
+        """
+        self.apply_moves()  # Отменяется последний ход, в том числе сделанный в этом кадре
+        if self.engine.win:  # Ходы кадра привели к победе, и рекорд уже сохранён
+            return None
+        tile = self.engine.undo() if direction < 0 else self.engine.redo()
+        if self.engine.win and not self.replay:
+            self.save_score()
+        return tile
+
+    def save_score(self):
+        """
+        Сохранение рекорда
+        """
+        old_record = self.app.scores[self.app.player_name] if self.app.player_name in self.app.scores else None
+        # Счёт рекорда старого формата не сравним с новым, поэтому такой рекорд заменяется любым новым
+        if old_record is None or old_record['legacy'] or self.engine.score > old_record['score']:
+            self.high_score = True
+            self.app.scores[self.app.player_name] = {'score': self.engine.score,
+                                                     'size': f'{self.app.rows}x{self.app.cols}',
+                                                     'time': format_time(self.engine.time),
+                                                     'turns': self.engine.turns}
+        self.rank = self.app.scores.rank(self.app.player_name)
+
+        if self.app.record_path:
+            os.makedirs(os.path.dirname(self.app.record_path), exist_ok=True)
+            with open(self.app.record_path, 'wb') as f:
+                f.write(self.engine.record())
 
     def event_handler(self, event):
         """
         Обработка событий
         """
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            x, y = pygame.mouse.get_pos()
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
+            self.dirty = True  # Действие игрока может изменить изображение
+        elif event.type == pygame.WINDOWEXPOSED:
+            self.redraw = True
 
-            # Обычное состояние игрового процесса
-            if (self.grid_x <= x <= self.grid_x + self.grid_width and self.grid_y <= y <= self.grid_y + self.grid_height
-                    and not self.pause and not self.win):  # Курсор находится в пределах поля
-                tile_x, tile_y = (x - self.grid_x) // self.scale, (y - self.grid_y) // self.scale
-
-                if event.button == 1:  # Левая клавиша мыши
-                    _ = self.tiles[tile_y][tile_x] - 90  # Поворот фишки на 90 градусов по часовой стрелке
-                    self.turns += 1
-                    self.check_win()
-
-                elif event.button == 3:  # Правая клавиша мыши
-                    _ = self.tiles[tile_y][tile_x] + 90  # Поворот фишки на 90 градусов против часовой стрелки
-                    self.turns += 1
-                    self.check_win()
-
-            elif 0 <= x <= 64 and 0 <= y <= 64 and event.button == 1 and not self.pause and not self.win:
-                # Клик по кнопке паузы
-                self.pause = True
-
-            elif self.menu_button_x <= x <= self.menu_button_x + 320 and event.button == 1:
-
-                # Меню паузы
-                if self.pause:
-                    if 160 <= y <= 224:  # Клик по "Продолжить"
-                        self.pause = False
-                    elif 256 <= y <= 320:  # Клик по "Выйти в меню"
-                        self.app.state = MainMenu(self.app)
-
-                # Меню победы
-                elif self.win:
-                    if 224 <= y <= 288:  # Клик по "Играть ещё раз"
-                        self.app.state = Game(self.app)
-                    elif 320 <= y <= 384:  # Клик по "Выйти в меню"
-                        self.app.state = MainMenu(self.app)
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            # Нажатие передаётся области под курсором: кнопке открытого меню, кнопке паузы или полю
+            if self.pause:
+                self.pause_menu.index.dispatch(event)
+            elif self.engine.win:
+                self.win_menu.index.dispatch(event)
+            else:
+                self.index.dispatch(event)
+
+        elif event.type == pygame.MOUSEMOTION:
+            if event.buttons[1] and not self.pause and not self.engine.win:  # Перетаскивание поля средней клавишей
+                self.move_camera(-event.rel[0], -event.rel[1])
 
         elif event.type == pygame.KEYDOWN:
 
             # Обычное состояние игрового процесса
-            if not self.pause and not self.win:
+            if not self.pause and not self.engine.win:
                 if event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                    self.pause = True
+                    self.set_pause(True)
+                elif event.key == pygame.K_h and not self.replay:  # Нажатие H
+                    self.hint()
+                elif event.key in (pygame.K_z, pygame.K_y) and event.mod & pygame.KMOD_CTRL:
+                    # Ctrl+Z - отмена хода, Ctrl+Y или Ctrl+Shift+Z - повтор хода
+                    tile = self.step(-1 if event.key == pygame.K_z and not event.mod & pygame.KMOD_SHIFT else 1)
+                    if tile:
+                        self.show_tile(*tile)
+                elif event.key == pygame.K_SPACE and self.replay:  # Нажатие пробела
+                    self.replay_running = not self.replay_running
+                elif event.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN) and self.replay:  # Нажатие Page Up/Page Down
+                    self.replay_speed = (min(self.replay_speed * 2, 4096) if event.key == pygame.K_PAGEUP
+                                         else max(self.replay_speed // 2, 1))
+                elif event.key == pygame.K_d and analysis.available():  # Нажатие D (анализ требует numpy)
+                    self.toggle_dead_tiles()
+                elif event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):  # Нажатие +
+                    self.zoom(1)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):  # Нажатие -
+                    self.zoom(-1)
 
             # Меню паузы
             elif self.pause:
                 if event.key == pygame.K_RETURN:  # Нажатие Enter
-                    self.pause = False
+                    self.set_pause(False)
                 if event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                    self.app.state = MainMenu(self.app)
+                    self.exit_to_menu()
 
             # Меню победы
-            elif self.win:
+            elif self.engine.win:
                 if event.key == pygame.K_RETURN:  # Нажатие Enter
-                    self.app.state = Game(self.app)
+                    self.play_again()
                 if event.key == pygame.K_ESCAPE:  # Нажатие Escape
-                    self.app.state = MainMenu(self.app)
+                    self.exit_to_menu()
+                if event.key == pygame.K_r:  # Нажатие R - воспроизведение сыгранной игры
+                    self.app.state = Game(self.app, self.engine.record())
+
+    def click_board(self, event):
+        """
+        Нажатие на поле: поворот фишки или изменение масштаба вокруг курсора
+        """
+        tile_x, tile_y = self.tile_at(*event.pos)
+        if event.button == 1:  # Левая клавиша мыши
+            self.rotate_tile(tile_x, tile_y, -1)  # Поворот фишки на 90 градусов по часовой стрелке
+        elif event.button == 3:  # Правая клавиша мыши
+            self.rotate_tile(tile_x, tile_y, 1)  # Поворот фишки на 90 градусов против часовой стрелки
+        elif event.button == 4:  # Колесо мыши вверх (серия прокруток меняет масштаб за один раз)
+            self.zoom(event.clicks, event.pos)
+        elif event.button == 5:  # Колесо мыши вниз
+            self.zoom(-event.clicks, event.pos)
+
+    def play_again(self):
+        """
+        Новая игра с теми же параметрами
+
+        После записи, запущенной без имени игрока, сначала открывается меню новой игры для ввода имени
+        """
+        if self.app.player_name:
+            self.app.state = new_game(self.app)
+        else:
+            self.app.state = MainMenu(self.app)
+            self.app.state.open_new_game()
+
+    def exit_to_menu(self):
+        """
+        Выход в главное меню
+        """
+        self.app.state = MainMenu(self.app)
+
+    def set_pause(self, pause):
+        """
+        Включение и выключение паузы (время игры на паузе не идёт)
+        """
+        self.pause = pause
+        if pause or self.replay:
+            self.engine.pause()
+        else:
+            self.engine.resume()
+
+    def hint(self):
+        """
+        Подсказка: поворот первой неверно повёрнутой фишки решения на один шаг
+
+        Решение ищется в фоновом процессе (на больших полях поиск занимает секунды), а ход выполняется,
+        когда подсказка найдена
+        """
+        self.apply_moves()  # Подсказка учитывает ходы, сделанные в этом кадре
+        if self.hint_board is None:  # Подсказка ещё не ищется
+            self.request_hint()
+
+    def request_hint(self):
+        """
+        Запуск поиска подсказки для текущего положения фишек
+        """
+        board = self.engine.board.copy()
+        self.hint_board = bytes(board.cells)
+        self.app.board_pool.submit(find_hint, (board, self.engine.solve_limit),
+                                   lambda move, cells=self.hint_board: setattr(self, 'hint_result', (cells, move)))
+
+    def apply_hint(self):
+        """
+        Выполнение хода найденной подсказки
+
+        Если фишки повернулись, пока подсказка искалась, поиск запускается заново для нового положения
+        """
+        cells, move = self.hint_result
+        self.hint_result = None
+        self.dirty = True
+        if self.pause or self.engine.win:
+            self.hint_board = None
+        elif bytes(self.engine.board.cells) != cells:
+            self.request_hint()
+        else:
+            self.hint_board = None
+            if move:
+                self.rotate_tile(*move)
+                self.apply_moves()
+                self.show_tile(move[0], move[1])
+
+    def toggle_dead_tiles(self):
+        """
+        Включение и выключение выделения мёртвых фишек
+        """
+        if self.dead_tiles is None:
+            self.dead_tiles = analysis.analyse(self.engine.board, reachability=True)[0]
+        self.show_dead = not self.show_dead
+        self.chunks.clear()  # Блоки поля отрисовываются заново
+        self.redraw = True
 
     def loop(self):
         """
         Цикл игрового процесса
         """
-        self.app.clock.tick(60)  # Ограничение FPS до 60
+        self.app.clock.tick(self.app.fps)  # Ограничение FPS
+        self.apply_moves()  # Ходы из всех событий кадра и один пересчёт пути воды
+        if self.hint_result is not None:  # Подсказка найдена в фоновом процессе
+            self.apply_hint()
+        frame_time = min(self.app.clock.get_time() / 1000, 0.1)  # Время с предыдущего кадра без ожидания событий
+
+        if not self.pause and not self.engine.win:
+            if not self.replay:
+                if self.rendered_header != self.header_values():  # Прошла секунда или найдена подсказка
+                    self.dirty = True
+
+            elif self.replay_running:  # Выполнение ходов записи с выбранной скоростью
+                self.replay_progress += self.replay_speed * frame_time
+                last_tile = None
+                while self.replay_progress >= 1:
+                    self.replay_progress -= 1
+                    tile = self.step(1)
+                    if tile is None:  # Запись закончилась
+                        self.replay_progress = 0
+                    else:
+                        last_tile = tile
+                if last_tile:
+                    self.show_tile(*last_tile)  # Видимая область следует за ходами записи
+                    self.dirty = True
+
+            # Прокрутка поля стрелками (четверть фишки за кадр при 60 кадрах в секунду)
+            keys = pygame.key.get_pressed()
+            speed = max(round(self.scale * 15 * frame_time), 1)
+            self.move_camera((keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * speed,
+                             (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * speed)
+
+        self.event_timeout = self.next_event_timeout()
+
+    def next_event_timeout(self):
+        """
+        Время ожидания событий до следующего кадра в миллисекундах (None - без ожидания)
 
-        if not self.pause and not self.win:
-            self.time += 1  # Увеличение счётчика времени
+        Без прокрутки и воспроизведения записи кадр нужен только тогда, когда на счётчике сменится секунда,
+        поэтому между секундами процессор не загружается
+        """
+        if not self.pause and not self.engine.win:
+            keys = pygame.key.get_pressed()
+            if keys[pygame.K_RIGHT] or keys[pygame.K_LEFT] or keys[pygame.K_DOWN] or keys[pygame.K_UP]:
+                return None  # Прокрутка поля идёт каждый кадр
+            if self.replay and self.replay_running and self.engine.move_count < len(self.engine.moves):
+                return None  # Ходы записи выполняются каждый кадр
+        if self.hint_board is not None:
+            return 50  # Готовность подсказки проверяется после каждого ожидания событий
+        if self.pause or self.engine.win or self.replay:
+            return 1000  # Счётчик времени остановлен
+        return 1000 - int(self.engine.time * 1000) % 1000
+
+    def set_scale(self, scale, focus=None):
+        """
+        Изменение размера фишки с сохранением точки поля, находящейся на экране в точке focus
+        """
+        if self.scale:  # Точка поля под focus в фишках
+            focus = focus or self.view.center
+            focus_x = (focus[0] - self.view.x + self.camera_x) / self.scale
+            focus_y = (focus[1] - self.view.y + self.camera_y) / self.scale
+        else:  # Первое задание масштаба: видна левая верхняя часть поля с начальной фишкой
+            focus = None
+
+        self.scale = scale
+        self.grid_width, self.grid_height = self.app.cols * self.scale, self.app.rows * self.scale  # Размер поля
 
-    def render(self):
+        # Видимая область поля на экране
+        view_width, view_height = min(self.grid_width, self.width), min(self.grid_height, self.height - 64)
+        self.view = pygame.Rect((self.width - view_width) // 2, (self.height - view_height + 64) // 2,
+                                view_width, view_height)
+
+        # Кэш блоков рассчитан на две видимые области, поэтому занимаемая память не зависит от размера поля
+        chunk_width = CHUNK_SIZE * self.scale
+        self.max_chunks = 2 * (view_width // chunk_width + 2) * (view_height // chunk_width + 2)
+        self.chunks.clear()
+
+        if focus is None:
+            self.camera_x, self.camera_y = 0, 0
+        else:
+            self.camera_x = round(focus_x * self.scale) - (focus[0] - self.view.x)
+            self.camera_y = round(focus_y * self.scale) - (focus[1] - self.view.y)
+        self.move_camera(0, 0)
+        self.redraw = True
+
+        # Области нажатий во время игры: кнопка паузы и видимая область поля
+        self.index = HitIndex()
+        self.index.add((0, 0, 64, 64), lambda event: self.set_pause(True))
+        self.index.add(self.view, self.click_board, (1, 3, 4, 5))
+
+    def zoom(self, step, focus=None):
         """
-        Отрисовка игрового процесса
+        Увеличение (step > 0) или уменьшение (step < 0) масштаба поля
         """
-        self.app.screen.fill('white')  # Заливка экрана белым цветом, чтобы избавиться от прошлого кадра
+        index = min(max(SCALES.index(self.scale) + step, 0), len(SCALES) - 1)
+        if SCALES[index] != self.scale:
+            self.set_scale(SCALES[index], focus)
+            self.dirty = True
 
-        self.app.screen.blit(self.pause_button, (8, 8))  # Отрисовка кнопки паузы
+    def move_camera(self, dx, dy):
+        """
+        Сдвиг видимой области поля
+        """
+        camera_x = min(max(self.camera_x + dx, 0), self.grid_width - self.view.width)
+        camera_y = min(max(self.camera_y + dy, 0), self.grid_height - self.view.height)
+        if (camera_x, camera_y) != (self.camera_x, self.camera_y):
+            self.camera_x, self.camera_y = camera_x, camera_y
+            self.redraw = True
+            self.dirty = True
+
+    def show_tile(self, tile_x, tile_y):
+        """
+        Сдвиг видимой области так, чтобы фишка оказалась в её центре, если фишка не видна
+        """
+        if not self.view.contains(self.tile_rect(tile_x, tile_y)):
+            self.move_camera(tile_x * self.scale + (self.scale - self.view.width) // 2 - self.camera_x,
+                             tile_y * self.scale + (self.scale - self.view.height) // 2 - self.camera_y)
+
+    def tile_at(self, x, y):
+        """
+        Координаты фишки под точкой экрана
+        """
+        return (x - self.view.x + self.camera_x) // self.scale, (y - self.view.y + self.camera_y) // self.scale
+
+    def tile_rect(self, tile_x, tile_y):
+        """
+        Положение фишки на экране
+        """
+        return pygame.Rect(self.view.x - self.camera_x + tile_x * self.scale,
+                           self.view.y - self.camera_y + tile_y * self.scale, self.scale, self.scale)
+
+    def get_chunk(self, chunk_x, chunk_y):
+        """
+        Получение отрисованного блока поля из кэша
+        """
+        if (chunk_x, chunk_y) in self.chunks:
+            self.chunks.move_to_end((chunk_x, chunk_y))
+            return self.chunks[(chunk_x, chunk_y)]
+
+        tiles_x = range(chunk_x * CHUNK_SIZE, min(chunk_x * CHUNK_SIZE + CHUNK_SIZE, self.app.cols))
+        tiles_y = range(chunk_y * CHUNK_SIZE, min(chunk_y * CHUNK_SIZE + CHUNK_SIZE, self.app.rows))
+        self.chunks[(chunk_x, chunk_y)] = pygame.Surface((len(tiles_x) * self.scale, len(tiles_y) * self.scale))
+        for tile_y in tiles_y:
+            for tile_x in tiles_x:
+                self.draw_tile(tile_x, tile_y)
+
+        while len(self.chunks) > self.max_chunks:  # Удаление давно не использованных блоков
+            self.chunks.popitem(last=False)
+        return self.chunks[(chunk_x, chunk_y)]
+
+    def draw_grid(self):
+        """
+        Отрисовка видимой области поля из блоков
+        """
+        chunk_width = CHUNK_SIZE * self.scale
+        first_x, last_x = self.camera_x // chunk_width, (self.camera_x + self.view.width - 1) // chunk_width
+        first_y, last_y = self.camera_y // chunk_width, (self.camera_y + self.view.height - 1) // chunk_width
+        self.app.screen.set_clip(self.view)
+        for chunk_y in range(first_y, last_y + 1):
+            for chunk_x in range(first_x, last_x + 1):
+                position = self.tile_rect(chunk_x * CHUNK_SIZE, chunk_y * CHUNK_SIZE)
+                self.app.screen.blit(self.get_chunk(chunk_x, chunk_y), position)
+        self.app.screen.set_clip(None)
+
+    def draw_tile(self, tile_x, tile_y):
+        """
+        Отрисовка фишки и воды в ней на поверхности блока поля
+        """
+        chunk = self.chunks[(tile_x // CHUNK_SIZE, tile_y // CHUNK_SIZE)]
+        x, y = tile_x % CHUNK_SIZE * self.scale, tile_y % CHUNK_SIZE * self.scale
+        angle = self.engine.board.rotation(tile_x, tile_y) * 90
+        chunk.fill('white', (x, y, self.scale, self.scale))
+        chunk.blit(self.get_sprite(PIPES[self.engine.board.pipe(tile_x, tile_y)], angle), (x, y))
+        for pipe in self.engine.water_map.get((tile_x, tile_y), []):
+            chunk.blit(self.get_sprite(PIPES[pipe], angle, True), (x, y))
+        if self.show_dead and self.dead_tiles[tile_y, tile_x]:  # Окрашивание мёртвой фишки
+            chunk.fill((255, 160, 160), (x, y, self.scale, self.scale), special_flags=pygame.BLEND_RGB_MULT)
+
+    def draw_header(self):
+        """
+        Отрисовка счётчиков времени и ходов
+        """
+        header_rect = pygame.Rect(64, 0, self.width - 64, 64)
+        self.app.screen.fill('white', header_rect)
 
         # Отрисовка счётчика времени
-        time_text = self.app.font_45.render(f'{self.time // 3600:02}:{self.time // 60 % 60:02}', True, 'black')
+        time_text = self.app.text_cache.render(self.app.font_45, format_time(self.engine.time), 'black')
         time_x = (self.width - time_text.get_width()) // 2
         self.app.screen.blit(time_text, (time_x, -1))
 
         # Отрисовка счётчика ходов
-        turns_text = self.app.font_45.render(f'{self.turns}', True, 'black')
+        turns_text = self.app.text_cache.render(self.app.font_45, f'{self.shown_turns}', 'black')
         turns_x = self.width - turns_text.get_width() - 16
         self.app.screen.blit(turns_text, (turns_x, -1))
 
-        # Отрисовка фишек
-        for tile_y, row in enumerate(self.tiles):
-            for tile_x, tile in enumerate(row):
-                x, y = self.grid_x + tile_x * self.scale, self.grid_y + tile_y * self.scale
-                scaled_image = pygame.transform.scale(pygame.transform.rotate(tile.image, tile.angle),
-                                                      (self.scale, self.scale))
-                self.app.screen.blit(scaled_image, (x, y))
-
-        # Отрисовка воды в трубах
-        for tile_x, tile_y, pipe in self.water:
-            x, y = self.grid_x + tile_x * self.scale, self.grid_y + tile_y * self.scale
-            scaled_water = pygame.transform.scale(pygame.transform.rotate(
-                self.water_images[pipe], self.tiles[tile_y][tile_x].angle), (self.scale, self.scale))
-            self.app.screen.blit(scaled_water, (x, y))
-
-        # Отрисовка меню паузы
-        if self.pause:
-            self.pause_menu.draw()
-
-        # Отрисовка меню победы
-        if self.win:
-            self.app.screen.blit(self.menu_tint, (0, 0))  # Отрисовка затемнения экрана
-            self.app.screen.blit(self.win_menu_bg, ((self.width - 384) // 2, 64))  # Отрисовка фона меню победы
-
-            # Отрисовка заголовка меню победы
-            win_title_text = self.app.font_45.render('Новый рекорд!' if self.high_score else 'Победа!', True, 'black')
-            win_title_x = (self.width - win_title_text.get_width()) // 2
-            self.app.screen.blit(win_title_text, (win_title_x, 63))
-
-            # Отрисовка счёта
-            score_text = self.app.font_45.render(f'Cчёт: {self.score}', True, 'black')
-            score_x = (self.width - score_text.get_width()) // 2
-            self.app.screen.blit(score_text, (score_x, 143))
-
-            # Отрисовка кнопок меню победы
-            for i, button in enumerate(self.win_menu_buttons):
-                button.draw(self.menu_button_x, 224 + 96 * i)
+        # Поиск подсказки
+        if self.hint_board is not None:
+            hint_text = self.app.text_cache.render(self.app.font_24, 'подсказка...', 'gray')
+            self.app.screen.blit(hint_text, (72, 18))
 
-        pygame.display.flip()  # Отображение изменений на экране
+        self.rendered_header = self.header_values()
+        return header_rect
+
+    def header_values(self):
+        """
+        Значения, показываемые в заголовке: (секунды, ходы, ищется ли подсказка)
+        """
+        return int(self.engine.time), self.shown_turns, self.hint_board is not None
+
+    @property
+    def shown_turns(self):
+        """
+        Счётчик ходов в заголовке: при просмотре записи - номер текущего хода записи
+        """
+        return self.engine.move_count if self.replay else self.engine.turns
+
+    def render(self):
+        """
+        Отрисовка игрового процесса
+        """
+        # Перерисовка изменившихся фишек в отрисованных блоках поля
+        self.dirty_tiles.update(self.engine.changed_tiles)
+        self.engine.changed_tiles.clear()
+        dirty_tiles = []
+        for tile_x, tile_y in self.dirty_tiles:
+            if (tile_x // CHUNK_SIZE, tile_y // CHUNK_SIZE) in self.chunks:
+                self.draw_tile(tile_x, tile_y)
+                if self.view.colliderect(self.tile_rect(tile_x, tile_y)):  # Фишка видна на экране
+                    dirty_tiles.append((tile_x, tile_y))
+        self.dirty_tiles.clear()
+
+        mode = (self.pause, self.engine.win)
+        if self.redraw or mode != self.rendered_mode:  # Полная перерисовка экрана
+            self.redraw = False
+            self.rendered_mode = mode
+
+            self.app.screen.fill('white')  # Заливка экрана белым цветом, чтобы избавиться от прошлого кадра
+            self.app.screen.blit(self.pause_button, (8, 8))  # Отрисовка кнопки паузы
+            self.draw_header()
+            self.draw_grid()  # Отрисовка видимой области поля
+
+            # Отрисовка меню паузы
+            if self.pause:
+                self.pause_menu.draw()
+
+            # Отрисовка меню победы
+            if self.engine.win:
+                self.win_menu.title = ('Конец записи' if self.replay
+                                       else 'Новый рекорд!' if self.high_score else 'Победа!')
+                self.win_menu.draw()
+
+                if not self.replay:  # Запись воспроизводится без подсчёта времени, поэтому счёт не показывается
+                    # Отрисовка счёта
+                    score_text = self.app.text_cache.render(self.app.font_45, f'Cчёт: {self.engine.score}', 'black')
+                    score_x = (self.width - score_text.get_width()) // 2
+                    self.app.screen.blit(score_text, (score_x, 124))
+
+                    # Отрисовка места в таблице рекордов
+                    rank_text = self.app.text_cache.render(self.app.font_32, f'Место в таблице: {self.rank}', 'black')
+                    rank_x = (self.width - rank_text.get_width()) // 2
+                    self.app.screen.blit(rank_text, (rank_x, 176))
+
+                    # Отрисовка начального значения генератора, с которым поле можно сыграть ещё раз
+                    seed_text = self.app.text_cache.render(self.app.font_24, f'Поле: --seed {self.seed}', 'gray')
+                    self.app.screen.blit(seed_text, ((self.width - seed_text.get_width()) // 2, 386))
+
+            pygame.display.flip()  # Отображение изменений на экране
+
+        elif not self.pause and not self.engine.win:  # Обновление только изменившихся областей экрана
+            update_rects = []
+            self.app.screen.set_clip(self.view)
+            for tile_x, tile_y in dirty_tiles:
+                chunk_area = pygame.Rect(tile_x % CHUNK_SIZE * self.scale, tile_y % CHUNK_SIZE * self.scale,
+                                         self.scale, self.scale)
+                rect = self.tile_rect(tile_x, tile_y)
+                self.app.screen.blit(self.chunks[(tile_x // CHUNK_SIZE, tile_y // CHUNK_SIZE)], rect, chunk_area)
+                update_rects.append(rect.clip(self.view))
+            self.app.screen.set_clip(None)
+            if self.rendered_header != self.header_values():  # Изменились значения заголовка
+                update_rects.append(self.draw_header())
+            if update_rects:
+                pygame.display.update(update_rects)  # Отображение изменений на экране
+
+
+def profiler_hooks():
+    """
+    Этапы кадра для замеров: методы состояний, которые вызывает App.execute, проверка победы,
+    отрисовка текста и вывод на экран
+    """
+    hooks = []
+    for state in (MainMenu, Leaderboard, BoardPreparation, Game):
+        hooks += [(state, 'event_handler', 'events'), (state, 'loop', 'loop'), (state, 'render', 'render')]
+    return hooks + [(Engine, 'check_win', 'check_win'), (TextCache, 'render', 'text'),
+                    (pygame.display, 'flip', 'flip'), (pygame.display, 'update', 'flip')]
 
 
 if __name__ == '__main__':
-    app = App()
+    parser = argparse.ArgumentParser(description='Игра "Трубопровод"')
+    parser.add_argument('--seed', type=int, help='начальное значение генератора полей (одинаковые поля в каждой игре)')
+    parser.add_argument('--replay', metavar='FILE', help=f'воспроизведение записи игры (например, {RECORD_PATH})')
+    parser.add_argument('--fps', type=int, default=60, help='ограничение частоты кадров (0 - без ограничения)')
+    parser.add_argument('--no-preload', action='store_true', help='не загружать изображения в фоновом потоке')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='запись времени этапов каждого кадра в файл CSV (.csv) или JSON (F3 - окно замеров)')
+    args = parser.parse_args()
+
+    record = None
+    if args.replay:
+        with open(args.replay, 'rb') as f:
+            record = f.read()
+    app = App(args.seed, record, args.fps, not args.no_preload, args.profile)
     app.execute()
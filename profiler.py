@@ -0,0 +1,119 @@
+"""
+Замеры времени этапов кадра без внешнего профилировщика
+
+Модуль не зависит от pygame: этапы задаются списком методов и функций, вокруг которых устанавливаются обёртки
+"""
+import csv
+import json
+from collections import deque
+from time import perf_counter
+
+
+class FrameProfiler:
+    """
+    Счётчики времени этапов кадра и журнал кадров для выгрузки в CSV или JSON
+
+    Обёртки устанавливаются вместо методов и функций только на время замеров, поэтому выключенный профилировщик
+    не замедляет игру. Время этапа включает время вложенных этапов (например, отрисовка включает вывод на экран)
+    """
+
+    def __init__(self, hooks, history=60, trace_path=None):
+        self.hooks = hooks  # Измеряемые функции: [(класс или модуль, имя атрибута, этап)]
+        self.stages = list(dict.fromkeys(stage for _, _, stage in hooks))
+        self.originals = []  # Заменённые атрибуты: [(класс или модуль, имя атрибута, исходное значение)]
+        self.current = dict.fromkeys(self.stages, 0.0)  # Время этапов текущего кадра в секундах
+        self.frames = deque(maxlen=history)  # Последние кадры для средних значений
+        self.trace_path = trace_path  # Файл журнала кадров (None - журнал не ведётся)
+        self.trace = []  # Журнал кадров: [(номер кадра, время кадра, время этапов..., размер поля)]
+        self.frame_count = 0
+        self.frame_start = None  # Начало текущего кадра (None - кадр не измеряется)
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self):
+        """
+        Установка обёрток
+        """
+        if self.enabled:
+            return
+        for owner, name, stage in self.hooks:
+            original = vars(owner)[name]
+            self.originals.append((owner, name, original))
+            setattr(owner, name, self.wrap(original, stage))
+        self.frames.clear()
+        self.frame_start = None
+
+    def disable(self):
+        """
+        Восстановление исходных методов и функций
+        """
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals.clear()
+        self.frame_start = None
+
+    def wrap(self, function, stage):
+        """
+        Обёртка, добавляющая время выполнения функции к счётчику этапа
+        """
+        current = self.current
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current[stage] += perf_counter() - start
+        return wrapper
+
+    def begin_frame(self):
+        """
+        Начало кадра: обнуление счётчиков этапов
+        """
+        for stage in self.current:
+            self.current[stage] = 0.0
+        self.frame_start = perf_counter()
+
+    def end_frame(self, size, **extra):
+        """
+        Конец кадра: запись времени кадра и этапов
+
+        extra - этапы, измеренные без обёрток (например, ожидание ограничения FPS), в секундах
+        """
+        if self.frame_start is None:  # Замеры включены посреди кадра
+            return
+        frame = dict(self.current, **extra)
+        frame['frame'] = perf_counter() - self.frame_start
+        self.frames.append(frame)
+        self.frame_count += 1
+        if self.trace_path:
+            self.trace.append((self.frame_count, size, frame))
+        self.frame_start = None
+
+    def averages(self):
+        """
+        Среднее время кадра и этапов за последние кадры в секундах
+        """
+        if not self.frames:
+            return {}
+        return {stage: sum(frame[stage] for frame in self.frames) / len(self.frames) for stage in self.frames[-1]}
+
+    def save(self):
+        """
+        Запись журнала кадров в файл: CSV (по расширению .csv) или JSON (время в миллисекундах)
+        """
+        if not self.trace_path or not self.trace:
+            return
+        stages = list(self.trace[-1][2])
+        rows = [{'frame': number, 'size': size, **{f'{stage}_ms': round(frame.get(stage, 0) * 1000, 4)
+                                                  for stage in stages}}
+                for number, size, frame in self.trace]
+        with open(self.trace_path, 'w', encoding='utf-8', newline='') as f:
+            if self.trace_path.endswith('.csv'):
+                writer = csv.DictWriter(f, rows[0].keys())
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump(rows, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,137 @@
+"""
+Поиск минимального набора поворотов фишек, соединяющего начальную и конечную фишки
+"""
+from heapq import heappush, heappop
+
+from board import DX, DY, FLOW, END
+
+
+def rotation_cost(current, target):
+    """
+    Количество поворотов (ходов), за которое фишка переходит из одного поворота в другой
+    """
+    turns = (target - current) % 4
+    return min(turns, 4 - turns)
+
+
+def solve(board, limit=None):
+    """
+    Поиск решения поля
+
+    Путь ищется без учёта того, что фишка на пути может встретиться дважды. Если найденный путь проходит
+    через фишку с двумя разными поворотами, задача делится на две: с поворотом фишки из первого прохода
+    и со всеми остальными поворотами. Подзадачи перебираются по возрастанию стоимости, поэтому первое
+    найденное непротиворечивое решение минимально. Возвращает список ходов [(x, y, повороты)] в порядке
+    движения воды (повороты > 0 - против часовой стрелки, повороты < 0 - по часовой) или None, если решения нет
+
+    На больших полях подзадач может быть очень много, поэтому после limit поисков пути подзадачи
+    перебираются в глубину, и возвращается лучшее из найденных решений (не обязательно минимальное)
+    """
+    cells, cols = board.cells, board.cols
+    heap = [(0, 0, {}, None)]  # Подзадачи: (стоимость, номер, допустимые повороты фишек, решение)
+    counter = 1
+    searches = 0
+    while heap:
+        _, _, allowed, moves = heappop(heap)
+        if moves is not None:
+            return moves
+
+        searches += 1
+        depth_first = limit is not None and searches > limit  # Перебор в глубину после исчерпания limit
+        result = search(board, allowed)
+        if result is None:
+            continue
+        cost, path = result
+
+        rotations = {}
+        conflict = next(((i, rotations[i]) for i, rotation in path if rotations.setdefault(i, rotation) != rotation),
+                        None)
+        if conflict is None:  # Решение непротиворечиво
+            moves = {}
+            for i, rotation in path:
+                turns = (rotation - (cells[i] & 3)) % 4
+                if turns:
+                    moves[i] = turns if turns <= 2 else turns - 4
+            moves = [(i % cols, i // cols, turns) for i, turns in moves.items()]
+            if depth_first:  # Лучшее из уже найденных решений
+                return min([(count_moves(moves), moves)] + [(item[0], item[3]) for item in heap
+                                                             if item[3] is not None])[1]
+            heappush(heap, (count_moves(moves), counter, allowed, moves))
+            counter += 1
+        else:  # Разделение задачи по повороту фишки, встретившейся с разными поворотами
+            i, rotation = conflict
+            other = tuple(r for r in allowed.get(i, range(4)) if r != rotation)
+            for rotations in (other, (rotation,)) if depth_first else ((rotation,), other):
+                # При переборе в глубину последняя подзадача извлекается первой
+                heappush(heap, (-counter if depth_first else cost, counter, {**allowed, i: rotations}, None))
+                counter += 1
+    return None
+
+
+def search(board, allowed):
+    """
+    Поиск кратчайшего пути (по количеству ходов) в пространстве состояний (фишка, направление входящей воды)
+
+    allowed ограничивает повороты отдельных фишек. Шаг стоит не больше двух ходов, поэтому вместо кучи
+    используется очередь из корзин по стоимости, и каждое состояние раскрывается один раз.
+    Возвращает (стоимость, [(индекс фишки, поворот)] от начальной фишки до конечной) или None
+    """
+    rows, cols, cells = board.rows, board.cols, board.cells
+    end = (cols - 1) + (rows - 1) * cols
+
+    # Фишки, поставленные на путь: (индекс фишки, поворот, номер предыдущей фишки)
+    nodes = [(0, None, -1)]
+    buckets = [[], [], []]  # Состояния, сгруппированные по стоимости: (индекс фишки, направление воды, номер фишки)
+    for rotation in allowed.get(0, range(4)):  # Поворот начальной фишки
+        if 0 <= DX[rotation] < cols and 0 <= DY[rotation] < rows:
+            nodes.append((0, rotation, 0))
+            buckets[rotation_cost(cells[0] & 3, rotation)].append((DX[rotation] + DY[rotation] * cols, rotation,
+                                                                   len(nodes) - 1))
+
+    settled = set()
+    cost = 0
+    while any(buckets[cost:]):
+        buckets.append([])
+        for i, direction, node in buckets[cost]:  # Корзина пополняется шагами нулевой стоимости
+            if direction is None:  # Вода достигла конечной фишки
+                path = []
+                while node > 0:
+                    i, rotation, node = nodes[node]
+                    path.append((i, rotation))
+                return cost, path[::-1]
+
+            if (i, direction) in settled:
+                continue
+            settled.add((i, direction))
+
+            pipe, current = cells[i] >> 2, cells[i] & 3
+
+            if i == end:  # Конечная фишка принимает воду, если повёрнута в направлении её движения
+                if pipe == END and direction in allowed.get(i, range(4)):
+                    nodes.append((i, direction, node))
+                    buckets[cost + rotation_cost(current, direction)].append((i, None, len(nodes) - 1))
+                continue
+
+            x, y = i % cols, i // cols
+            for rotation in allowed.get(i, range(4)):
+                water_flow = FLOW[((pipe << 2) + rotation) * 4 + direction]
+                if not water_flow:
+                    continue
+
+                out = water_flow[0]
+                next_x, next_y = x + DX[out], y + DY[out]
+                if not (0 <= next_x < cols and 0 <= next_y < rows) or (next_x + next_y * cols, out) in settled:
+                    continue
+
+                nodes.append((i, rotation, node))
+                buckets[cost + rotation_cost(current, rotation)].append((next_x + next_y * cols, out, len(nodes) - 1))
+        cost += 1
+
+    return None
+
+
+def count_moves(moves):
+    """
+    Количество ходов в решении
+    """
+    return sum(abs(turns) for _, _, turns in moves)
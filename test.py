@@ -1,5 +1,21 @@
 import unittest
-from main import change_size
+import pygame
+from main import change_size, coalesce_wheel, HitIndex, TextCache, App, Game, MainMenu
+from board import RIGHT, UP, LEFT, DOWN, FINISH, STRAIGHT, BEND, CROSS, START, END, flow, Board
+from generator import carve_path, lay_pipes, generate
+from solver import solve, count_moves
+from engine import Engine, replay
+from board_pool import BoardPool
+from profiler import FrameProfiler
+from scores import ScoreStore
+import analysis
+from random import Random
+import csv
+import json
+import os
+import pickle
+import tempfile
+import time
 
 
 class TestChangeSize(unittest.TestCase):
@@ -31,6 +47,622 @@ class TestChangeSize(unittest.TestCase):
         # Проверка нахождения курсора вне кнопки по оси Y
         self.assertEqual(change_size(12, 9, 18, 0, 24, 256, 1), 12)
 
+        # Проверка изменения размера с шагом
+        self.assertEqual(change_size(12, 9, 256, 0, 24, 232, 1, 10), 22)
+        self.assertEqual(change_size(12, 9, 256, 0, 24, 280, 1, 10), 9)
+
+
+class TestHitIndex(unittest.TestCase):
+    """
+    Тестирование поиска областей под курсором
+    """
+
+    def test_find(self):
+        index = HitIndex()
+        index.add((0, 64, 1000, 500), 'board', (1, 3))
+        index.add((0, 0, 64, 64), 'pause')
+        index.add((100, 100, 200, 50), 'button')
+        index.add((250, 120, 20, 20), 'overlay')  # Более поздняя область лежит сверху
+
+        self.assertEqual(index.find((10, 10), 1), 'pause')
+        self.assertEqual(index.find((299, 149), 1), 'button')
+        self.assertEqual(index.find((300, 149), 1), 'board')
+        self.assertEqual(index.find((260, 130), 1), 'overlay')
+        self.assertEqual(index.find((150, 120), 3), 'board')  # Кнопка не принимает правую клавишу мыши
+        self.assertIsNone(index.find((10, 10), 3))
+        self.assertIsNone(index.find((2000, 10), 1))
+
+    def test_coalesce_wheel(self):
+        def down(button, pos=(5, 5)):
+            return pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=button, pos=pos)
+
+        def up(button, pos=(5, 5)):
+            return pygame.event.Event(pygame.MOUSEBUTTONUP, button=button, pos=pos)
+
+        wheel = pygame.event.Event(pygame.MOUSEWHEEL, x=0, y=1)
+        events = coalesce_wheel([wheel, down(4), up(4), wheel, down(4), up(4), down(4), down(5), down(5),
+                                 down(5, (6, 5)), down(1), down(4)])
+        self.assertEqual([(event.button, event.clicks) for event in events if event.type == pygame.MOUSEBUTTONDOWN],
+                         [(4, 3), (5, 2), (5, 1), (1, 1), (4, 1)])
+
+
+class TestTextCache(unittest.TestCase):
+    """
+    Тестирование кэша отрисованного текста
+    """
+
+    def test_eviction(self):
+        pygame.font.init()
+        font = pygame.font.Font(None, 24)
+        cache = TextCache(size=2)
+        first = cache.render(font, '1', 'black')
+        second = cache.render(font, '2', 'black')
+        self.assertIs(cache.render(font, '1', 'black'), first)  # Строка отрисовывается один раз
+
+        # Вытесняется строка, которая дольше всего не использовалась ('2'), а недавно использованная остаётся
+        cache.render(font, '3', 'black')
+        self.assertEqual(list(cache.surfaces), [(font, '1', 'black'), (font, '3', 'black')])
+        self.assertIs(cache.render(font, '1', 'black'), first)
+        self.assertIsNot(cache.render(font, '2', 'black'), second)
+        self.assertEqual(list(cache.surfaces), [(font, '1', 'black'), (font, '2', 'black')])
+
+
+class TestFlow(unittest.TestCase):
+    """
+    Тестирование таблицы движения воды
+    """
+
+    def test_flow(self):
+        # Проверка прямой трубы
+        self.assertEqual(flow(STRAIGHT, 0, RIGHT), (RIGHT, STRAIGHT))
+        self.assertEqual(flow(STRAIGHT, 1, UP), (UP, STRAIGHT))
+        self.assertIsNone(flow(STRAIGHT, 1, RIGHT))
+
+        # Проверка колена
+        self.assertEqual(flow(BEND, 0, RIGHT), (DOWN, BEND))
+        self.assertEqual(flow(BEND, 1, LEFT), (DOWN, BEND))
+        self.assertEqual(flow(BEND, 3, DOWN), (LEFT, BEND))
+        self.assertIsNone(flow(BEND, 0, LEFT))
+
+        # Проверка двух коленей (по нижнему колену вода течёт с изображением колена)
+        self.assertEqual(flow(CROSS, 0, RIGHT), (DOWN, BEND))
+        self.assertEqual(flow(CROSS, 0, LEFT), (UP, CROSS))
+        self.assertEqual(flow(CROSS, 2, LEFT), (UP, BEND))
+
+        # Проверка начальной и конечной фишек
+        self.assertEqual(flow(END, 0, RIGHT), (FINISH, END))
+        self.assertEqual(flow(END, 3, DOWN), (FINISH, END))
+        self.assertIsNone(flow(END, 0, LEFT))
+        self.assertIsNone(flow(START, 0, RIGHT))
+
+    def test_flow_reversible(self):
+        # Вода, пущенная в обратную сторону, проходит трубу по тому же пути
+        for pipe in (STRAIGHT, BEND, CROSS):
+            for rotation in range(4):
+                for direction in range(4):
+                    water_flow = flow(pipe, rotation, direction)
+                    if water_flow:
+                        self.assertEqual(flow(pipe, rotation, (water_flow[0] + 2) % 4),
+                                         ((direction + 2) % 4, water_flow[1]))
+
+
+class TestBoard(unittest.TestCase):
+    """
+    Тестирование игрового поля
+    """
+
+    def test_rotate(self):
+        board = Board(9, 12)
+        board.set(3, 2, BEND, 0)
+
+        # Проверка поворота против часовой стрелки и по часовой стрелке
+        board.rotate(3, 2, 1)
+        self.assertEqual(board.rotation(3, 2), 1)
+        board.rotate(3, 2, -2)
+        self.assertEqual(board.rotation(3, 2), 3)
+        self.assertEqual(board.pipe(3, 2), BEND)
+        self.assertEqual(board.flow(3, 2, DOWN), (LEFT, BEND))
+
+        # Проверка того, что соседние фишки не изменились
+        self.assertEqual(board.pipe(4, 2), STRAIGHT)
+        self.assertEqual(board.rotation(2, 2), 0)
+
+    def test_copy(self):
+        board = Board(9, 9)
+        board.set(0, 0, START, 3)
+        board_copy = board.copy()
+        self.assertEqual(board, board_copy)
+        self.assertEqual(board.key(), board_copy.key())
+
+        board_copy.rotate(0, 0, 1)
+        self.assertNotEqual(board, board_copy)
+        self.assertEqual(board.rotation(0, 0), 3)
+
+    def test_bytes(self):
+        for rows, cols in ((9, 9), (9, 12), (200, 200)):
+            board = generate(rows, cols, rng=Random(rows * cols))
+            data = board.to_bytes()
+            self.assertEqual(len(data), 4 + (rows * cols + 1) // 2)
+            self.assertEqual(Board.from_bytes(data), board)
+
+        # Хэш зависит от поворотов фишек
+        board_copy = board.copy()
+        self.assertEqual(board_copy.digest(), board.digest())
+        board_copy.rotate(5, 5, 1)
+        self.assertNotEqual(board_copy.digest(), board.digest())
+
+        # Начальная и конечная фишки должны стоять в углах поля
+        board.set(5, 5, START, 0)
+        self.assertRaises(ValueError, board.to_bytes)
+        self.assertRaises(ValueError, Board.from_bytes, data[:-1])
+
+
+class TestGenerator(unittest.TestCase):
+    """
+    Тестирование генерации поля
+    """
+
+    def test_carve_path(self):
+        for rows, cols, length in ((9, 9, 0), (9, 9, 50), (18, 36, 300)):
+            path = carve_path(rows, cols, length, Random(rows * cols + length))
+
+            # Проверка начала, конца и длины пути
+            self.assertEqual(path[:2], [(0, 0), (1, 0)])
+            self.assertEqual(path[-2:], [(cols - 2, rows - 1), (cols - 1, rows - 1)])
+            self.assertGreaterEqual(len(path), min(length, rows * cols // 2))
+
+            # Проверка того, что путь не пересекает сам себя и состоит из соседних фишек
+            self.assertEqual(len(set(path)), len(path))
+            for (x1, y1), (x2, y2) in zip(path, path[1:]):
+                self.assertEqual(abs(x1 - x2) + abs(y1 - y2), 1)
+
+    def test_lay_pipes(self):
+        rng = Random(1)
+        path = carve_path(18, 36, 200, rng)
+        water, finished = lay_pipes(18, 36, path, 1, rng).trace()
+        self.assertTrue(finished)
+        self.assertEqual([(x, y) for x, y, _ in water], path)
+
+    def test_generate(self):
+        board = generate(18, 36, 0.5, rng=Random(2))
+        self.assertEqual((board.pipe(0, 0), board.rotation(0, 0)), (START, 0))
+        self.assertEqual((board.pipe(35, 17), board.rotation(35, 17)), (END, 0))
+        self.assertFalse(board.trace()[1])
+
+    def test_seed(self):
+        self.assertEqual(generate(18, 36, 0.5, seed=3), generate(18, 36, 0.5, seed=3))
+        self.assertEqual(generate(18, 36, 0.5, seed=3), generate(18, 36, 0.5, rng=Random(3)))
+        self.assertNotEqual(generate(18, 36, 0.5, seed=3), generate(18, 36, 0.5, seed=4))
+
+
+class TestSolver(unittest.TestCase):
+    """
+    Тестирование поиска решения
+    """
+
+    def test_solve(self):
+        for seed in range(10):
+            rng = Random(seed)
+            path = carve_path(18, 36, 150, rng)
+            board = lay_pipes(18, 36, path, 0.5, rng)
+
+            # Поворот нескольких фишек пути
+            scramble = 0
+            for x, y in path[1:-1:7]:
+                board.rotate(x, y, 1)
+                scramble += 1
+
+            moves = solve(board)
+            self.assertLessEqual(count_moves(moves), scramble)
+            for x, y, turns in moves:
+                board.rotate(x, y, turns)
+            self.assertTrue(board.trace()[1])
+
+    def test_solved(self):
+        rng = Random(1)
+        board = lay_pipes(9, 9, carve_path(9, 9, 0, rng), 0, rng)
+        self.assertEqual(solve(board), [])
+
+    def test_unsolvable(self):
+        # Поле из прямых труб, где вода не может спуститься к конечной фишке
+        board = Board(9, 9)
+        board.set(0, 0, START, 0)
+        board.set(8, 8, END, 0)
+        for i in range(1, 80):
+            board.cells[i] = STRAIGHT << 2
+        self.assertIsNone(solve(board))
+
+
+class TestEngine(unittest.TestCase):
+    """
+    Тестирование игрового процесса без отрисовки
+    """
+
+    def test_incremental_water(self):
+        rng = Random(3)
+        engine = Engine(generate(9, 9, 0.5, rng=rng))
+        for _ in range(500):
+            engine.rotate(rng.randrange(9), rng.randrange(9), rng.choice((1, -1)))
+            if engine.win:
+                break
+
+            # Путь воды после пересчёта с повёрнутой фишки совпадает с полным пересчётом
+            water = [list(pipe) for pipe in engine.water]
+            engine.check_win()
+            self.assertEqual(engine.water, water)
+
+    def test_win(self):
+        board = generate(18, 36, 0.5, rng=Random(4))
+        moves = solve(board)
+        now = [100.0]
+        engine = Engine(board, clock=lambda: now[0])
+        now[0] += 1.5
+        engine.pause()  # Время паузы не считается
+        now[0] += 60
+        engine.resume()
+        now[0] += 0.6
+        for x, y, turns in moves:
+            for _ in range(abs(turns)):
+                engine.rotate(x, y, 1 if turns > 0 else -1)
+
+        self.assertTrue(engine.win)
+        self.assertIsNone(engine.optimal_turns)  # Минимальное количество ходов ищется только при подсчёте очков
+        now[0] += 10  # После победы время остановлено
+        self.assertEqual(engine.score, 18 ** 2 * 36 ** 2 * 100 * count_moves(moves) // (2 * engine.turns))
+        self.assertEqual(engine.optimal_turns, count_moves(moves))
+        self.assertAlmostEqual(engine.time, 2.1)
+
+        # После победы ходы не принимаются
+        engine.rotate(5, 5, 1)
+        self.assertEqual(engine.turns, count_moves(moves))
+
+    def test_rotate_many(self):
+        rng = Random(7)
+        board = generate(12, 18, 0.5, rng=rng)
+        batched, sequential = Engine(board.copy()), Engine(board.copy())
+        for _ in range(100):
+            moves = [(rng.randrange(18), rng.randrange(12), rng.choice((1, -1))) for _ in range(rng.randrange(1, 8))]
+            batched.rotate_many(moves)
+            for move in moves:
+                sequential.rotate(*move)
+            # Серия ходов даёт тот же путь воды, что и пересчёт после каждого хода
+            self.assertEqual((batched.board, batched.water, batched.turns, batched.win),
+                             (sequential.board, sequential.water, sequential.turns, sequential.win))
+
+        # Победа, достигнутая посреди серии, не теряется: оставшиеся ходы не выполняются
+        board = generate(9, 9, 0.5, seed=11)
+        moves = [(x, y, 1 if turns > 0 else -1) for x, y, turns in solve(board) for _ in range(abs(turns))]
+        engine = Engine(board.copy())
+        engine.rotate_many(moves + [moves[-1]])
+        self.assertTrue(engine.win)
+        self.assertEqual(engine.turns, len(moves))
+        self.assertEqual(engine.move_count, len(moves))  # Лишний ход не попадает в журнал
+
+    def test_undo_redo(self):
+        rng = Random(5)
+        engine = Engine(generate(9, 9, 0.5, rng=rng))
+        boards, waters = [engine.board.copy()], [[list(pipe) for pipe in engine.water]]
+        while len(boards) < 50:
+            engine.rotate(rng.randrange(9), rng.randrange(9), rng.choice((1, -1, 2)))
+            self.assertFalse(engine.win)
+            boards.append(engine.board.copy())
+            waters.append([list(pipe) for pipe in engine.water])
+
+        # Отмена возвращает поле и путь воды к состоянию до хода, но считается ходом
+        for i in range(48, 29, -1):
+            self.assertIsNotNone(engine.undo())
+            self.assertEqual((engine.board, engine.water, engine.move_count), (boards[i], waters[i], i))
+        self.assertEqual(engine.turns, 49 + 19)
+        for i in range(31, 41):
+            engine.redo()
+            self.assertEqual((engine.board, engine.water, engine.move_count), (boards[i], waters[i], i))
+        self.assertEqual(engine.turns, 49 + 19 + 10)
+
+        # Новый ход отменяет возможность повторить отменённые ходы
+        engine.rotate(0, 0, 1)
+        self.assertIsNone(engine.redo())
+        self.assertEqual(len(engine.moves), 41)
+        while engine.undo():
+            pass
+        self.assertEqual((engine.board, engine.move_count), (boards[0], 0))
+
+    def test_replay(self):
+        board = generate(18, 36, 0.5, rng=Random(6))
+        engine = Engine(board.copy())
+        engine.rotate(3, 4, 1)
+        engine.undo()  # Отменённый ход и отмена считаются ходами, но не записываются
+        for x, y, turns in solve(board):
+            for _ in range(abs(turns)):
+                engine.rotate(x, y, 1 if turns > 0 else -1)
+        self.assertTrue(engine.win)
+
+        replayed = replay(engine.record())
+        self.assertTrue(replayed.win)
+        self.assertEqual((replayed.initial_board, replayed.board), (board, engine.board))
+        self.assertEqual((replayed.turns, replayed.water), (engine.turns - 2, engine.water))
+
+
+class TestGameView(unittest.TestCase):
+    """
+    Тестирование видимой области поля: координаты фишек на экране, прокрутка и масштаб
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        cls.app = App(preload=False, scores=ScoreStore(':memory:', None), record_path=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.board_pool.close()
+        cls.app.scores.close()
+        pygame.quit()
+
+    def game(self, rows, cols):
+        self.app.rows, self.app.cols = rows, cols
+        return Game(self.app, prepared=(generate(rows, cols, 0.5, seed=1), None, 1))
+
+    def test_start(self):
+        # Игра начинается с левой верхней части поля, где находится начальная фишка
+        for rows, cols in ((9, 9), (30, 30), (60, 20)):
+            game = self.game(rows, cols)
+            self.assertEqual((game.camera_x, game.camera_y), (0, 0))
+            self.assertEqual(game.tile_at(*game.view.topleft), (0, 0))
+            self.assertEqual(game.tile_rect(0, 0).topleft, game.view.topleft)
+
+    def test_move_camera(self):
+        game = self.game(60, 60)
+        game.move_camera(-100, -100)
+        self.assertEqual((game.camera_x, game.camera_y), (0, 0))
+        game.move_camera(10 ** 6, 10 ** 6)  # Видимая область не выходит за поле
+        self.assertEqual(game.tile_at(game.view.right - 1, game.view.bottom - 1), (59, 59))
+        self.assertEqual(game.tile_rect(59, 59).bottomright, game.view.bottomright)
+
+        game.move_camera(-1000, -700)
+        for point in (game.view.topleft, game.view.center, (game.view.right - 1, game.view.bottom - 1)):
+            tile = game.tile_at(*point)
+            self.assertTrue(game.tile_rect(*tile).collidepoint(point))
+
+    def test_zoom(self):
+        # Фишка под курсором остаётся под курсором при изменении масштаба
+        game = self.game(60, 60)
+        game.move_camera(700, 600)
+        focus = game.tile_rect(*game.tile_at(*game.view.center)).center
+        tile = game.tile_at(*focus)
+        for step in (1, 1, -1, -1):  # При размере фишки 16 поле помещается в окно целиком, и фишка смещается
+            scale = game.scale
+            game.zoom(step, focus)
+            self.assertNotEqual(game.scale, scale)
+            self.assertEqual(game.tile_at(*focus), tile)
+
+    def test_play_again_after_replay(self):
+        # Запись, запущенная без имени игрока, не начинает игру с записью рекорда без имени
+        replay = Game(self.app, self.game(9, 9).engine.record())
+        self.app.player_name = ''
+        replay.play_again()
+        self.assertIsInstance(self.app.state, MainMenu)
+        self.assertTrue(self.app.state.new_game)
+
+        self.app.player_name = 'a'
+        replay.play_again()
+        self.assertNotIsInstance(self.app.state, MainMenu)
+
+
+class TestBoardPool(unittest.TestCase):
+    """
+    Тестирование подготовки полей в фоновых процессах
+    """
+
+    def test_take(self):
+        pool = BoardPool(size=1, workers=1)
+        try:
+            # Без готовых полей поле не генерируется сразу, а запускается в фоновом процессе
+            self.assertIsNone(pool.take(9, 12, 0.5))
+            for seed in (None, 5):
+                deadline = time.monotonic() + 60
+                prepared = None
+                while prepared is None and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    prepared = pool.take(9, 12, 0.5, seed)
+                board, optimal_turns, seed = prepared
+                self.assertEqual((board.rows, board.cols), (9, 12))
+                self.assertEqual(optimal_turns, count_moves(solve(board)))
+                # Поле восстанавливается по начальному значению
+                self.assertEqual(board, generate(9, 12, 0.5, seed=seed))
+
+            # Поле с заданным начальным значением выдаётся копиями
+            board.rotate(1, 1, 1)
+            self.assertEqual(pool.take(9, 12, 0.5, 5)[0], generate(9, 12, 0.5, seed=5))
+
+            # С заданным начальным значением готовится только поле с этим значением, и оно уже готово
+            pool.prepare(9, 12, 0.5, 5)
+            self.assertEqual(pool.target, (9, 12, 0.5, 5))
+            self.assertEqual((len(pool.ready[pool.target]), pool.running[pool.target]), (1, 0))
+        finally:
+            pool.close()
+
+
+@unittest.skipUnless(analysis.available(), 'numpy не установлен')
+class TestAnalysis(unittest.TestCase):
+    """
+    Тестирование анализа поля средствами NumPy
+    """
+
+    def test_dead(self):
+        board = Board(3, 4)
+        for i in range(12):
+            board.cells[i] = BEND << 2
+        board.set(0, 0, START, RIGHT)
+        board.set(3, 2, END, RIGHT)
+        board.set(3, 0, STRAIGHT, 0)  # Прямая труба в углу не может пропустить воду
+        board.set(2, 0, STRAIGHT, 0)  # Прямая труба рядом с ней - тоже
+        dead, fixed, rotations = analysis.analyse(board)
+        self.assertEqual([(x, y) for y in range(3) for x in range(4) if dead[y, x]], [(2, 0), (3, 0)])
+        self.assertFalse(fixed[0, 0])
+        self.assertEqual(rotations[0, 0], 1 << RIGHT | 1 << DOWN)  # Начальная фишка в углу
+
+        # В поле из одной строки у прямой трубы единственное полезное положение
+        board = Board(1, 3)
+        board.set(0, 0, START, RIGHT)
+        board.set(1, 0, STRAIGHT, 0)
+        board.set(2, 0, END, RIGHT)
+        dead, fixed, rotations = analysis.analyse(board)
+        self.assertTrue(fixed.all())
+        self.assertEqual(rotations[0, 1], 1 << 0 | 1 << 2)
+
+    def test_unreachable(self):
+        # Мёртвые фишки отрезают от начальной фишки блок изгибов, который сам по себе может пропустить воду
+        board = Board(2, 4)
+        for i in range(8):
+            board.cells[i] = BEND << 2
+        board.set(0, 0, START, RIGHT)
+        board.set(0, 1, STRAIGHT, 0)
+        board.set(1, 1, STRAIGHT, 0)
+        board.set(3, 1, END, RIGHT)
+        self.assertFalse(analysis.analyse(board)[0][:, 2:].any())  # Без проверки связности блок считается живым
+        dead, fixed, rotations = analysis.analyse(board, reachability=True)
+        self.assertTrue(dead.all())
+        self.assertFalse(fixed.any())
+        self.assertFalse(rotations.any())
+
+    def test_solution(self):
+        # Вода в решённом поле проходит только через живые фишки с полезными поворотами
+        for seed in range(20):
+            board = generate(9, 12, 0.5, rng=Random(seed))
+            dead, fixed, rotations = analysis.analyse(board, reachability=True)  # Строже проверки без связности
+            for x, y, turns in solve(board):
+                board.rotate(x, y, turns)
+            for x, y, _ in board.trace()[0]:
+                self.assertFalse(dead[y, x])
+                self.assertTrue(rotations[y, x] >> board.rotation(x, y) & 1)
+
+
+class TestScoreStore(unittest.TestCase):
+    """
+    Тестирование таблицы рекордов в SQLite
+    """
+
+    @staticmethod
+    def record(score, legacy=False):
+        return {'score': score, 'size': '9x9', 'time': '01:00', 'turns': 10, 'legacy': legacy}
+
+    def test_top(self):
+        scores = ScoreStore(':memory:', None)
+        scores.update({'a': self.record(5), 'b': self.record(30), 'c': self.record(20)})
+        scores['d'] = self.record(10)
+        scores['a'] = self.record(40)  # Рекорд игрока заменяется
+
+        self.assertEqual(len(scores), 4)
+        self.assertIn('d', scores)
+        self.assertNotIn('e', scores)
+        self.assertEqual(scores['a'], self.record(40))
+        self.assertEqual([name for name, _ in scores.top(0, 3)], ['a', 'b', 'c'])
+        self.assertEqual(scores.top(3, 3), [('d', self.record(10))])
+        self.assertEqual(scores.rank('c'), 3)
+
+        scores['d'] = self.record(50)  # Рекорд переносится на новое место
+        self.assertEqual(scores.rank('d'), 1)
+        self.assertEqual([name for name, _ in scores.top(0, 7)], ['d', 'a', 'b', 'c'])
+        scores.close()
+
+    def test_views(self):
+        scores = ScoreStore(':memory:', None)
+        scores.update({'a': {'score': 30, 'size': '9x9', 'time': '02:00', 'turns': 20},
+                       'b': {'score': 20, 'size': '12x18', 'time': '01:00', 'turns': 30},
+                       'c': {'score': 10, 'size': '9x9', 'time': '10:00', 'turns': 10}})
+        self.assertEqual(scores.sizes(), ['9x9', '12x18'])
+        self.assertEqual([name for name, _ in scores.top(0, 7, order='time')], ['b', 'a', 'c'])
+        self.assertEqual([name for name, _ in scores.top(0, 7, '9x9', 'turns')], ['c', 'a'])
+        self.assertEqual(scores.count('12x18'), 1)
+
+        # Построенные индексы обновляются при записи рекорда
+        scores['b'] = {'score': 40, 'size': '9x9', 'time': '00:30', 'turns': 40}
+        self.assertEqual(scores.count('12x18'), 0)
+        self.assertEqual([name for name, _ in scores.top(0, 7, '9x9', 'turns')], ['c', 'a', 'b'])
+        self.assertEqual(scores.rank('b', '9x9', 'time'), 1)
+        self.assertEqual(scores.rank('c', '9x9'), 3)
+
+        # Место рекорда совпадает с его положением в представлении
+        rng = Random(3)
+        scores.update({f'p{i}': {'score': rng.randrange(5), 'size': rng.choice(['9x9', '12x18']),
+                                 'time': f'{rng.randrange(120):02}:{rng.randrange(60):02}', 'turns': rng.randrange(5),
+                                 'legacy': rng.random() < 0.2} for i in range(50)})
+        for size in (None, '9x9', '12x18'):
+            for order in ('score', 'time', 'turns'):
+                names = [name for name, _ in scores.top(0, 100, size, order)]
+                self.assertEqual(len(names), scores.count(size))
+                self.assertEqual([scores.rank(name, size, order) for name in names], list(range(1, len(names) + 1)))
+        scores.close()
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, legacy_path = os.path.join(directory, 'scores.db'), os.path.join(directory, 'scores.dat')
+            with open(legacy_path, 'wb') as f:
+                pickle.dump({'a': {'score': 50, 'size': '9x9', 'time': '01:00', 'turns': 10}}, f)
+
+            # Рекорды из файла старого формата переносятся в базу с пометкой и стоят после новых рекордов
+            scores = ScoreStore(path, legacy_path)
+            scores['b'] = self.record(7)
+            scores.close()
+            self.assertFalse(os.path.exists(legacy_path))
+
+            scores = ScoreStore(path, legacy_path)
+            self.assertEqual(scores.top(0, 7), [('b', self.record(7)), ('a', self.record(50, True))])
+            self.assertEqual(scores.rank('a'), 2)
+            scores.close()
+
+
+class TestFrameProfiler(unittest.TestCase):
+    """
+    Тестирование замеров времени этапов кадра
+    """
+
+    def test_hooks(self):
+        class State:
+            def loop(self):
+                return 'loop'
+
+        profiler = FrameProfiler([(State, 'loop', 'loop')])
+        loop = State.loop
+        profiler.enable()
+        self.assertIsNot(State.loop, loop)
+        profiler.begin_frame()
+        self.assertEqual(State().loop(), 'loop')
+        profiler.end_frame('9x9', wait=0.5)
+        self.assertEqual(set(profiler.averages()), {'loop', 'wait', 'frame'})
+        self.assertEqual(profiler.averages()['wait'], 0.5)
+
+        # После выключения методы восстанавливаются, а кадры не записываются
+        profiler.disable()
+        self.assertIs(State.loop, loop)
+        profiler.end_frame('9x9')
+        self.assertEqual(len(profiler.frames), 1)
+
+    def test_save(self):
+        class State:
+            def render(self):
+                pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('trace.csv', 'trace.json'):
+                path = os.path.join(directory, name)
+                profiler = FrameProfiler([(State, 'render', 'render')], trace_path=path)
+                profiler.enable()
+                for _ in range(3):
+                    profiler.begin_frame()
+                    State().render()
+                    profiler.end_frame('9x12')
+                profiler.disable()
+                profiler.save()
+                with open(path, encoding='utf-8') as f:
+                    if name.endswith('.csv'):
+                        rows = list(csv.DictReader(f))
+                    else:
+                        rows = json.load(f)
+                self.assertEqual([int(row['frame']) for row in rows], [1, 2, 3])
+                self.assertEqual(set(rows[0]), {'frame', 'size', 'render_ms', 'frame_ms'})
+                self.assertEqual(rows[0]['size'], '9x12')
+
 
 if __name__ == '__main__':
     unittest.main()